@@ -0,0 +1,81 @@
+"""
+Compares paths/sec of Django's test `Client` against
+`django_medusa.client.RequestEngine` on a throwaway in-memory site.
+
+    python benchmarks/bench_client.py [--paths 2000] [--repeat 3]
+"""
+from __future__ import print_function
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(
+    os.path.dirname(__file__), os.pardir
+)))
+
+from django.conf import settings
+
+settings.configure(
+    DEBUG=False,
+    SECRET_KEY="benchmark",
+    ALLOWED_HOSTS=["*"],
+    ROOT_URLCONF=__name__,
+    INSTALLED_APPS=["django.contrib.contenttypes", "django.contrib.auth",
+                    "django.contrib.sessions", "django_medusa"],
+    MIDDLEWARE=[
+        "django.contrib.sessions.middleware.SessionMiddleware",
+        "django.middleware.common.CommonMiddleware",
+        "django.contrib.auth.middleware.AuthenticationMiddleware",
+    ],
+    DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3",
+                           "NAME": ":memory:"}},
+    TEMPLATES=[{"BACKEND": "django.template.backends.django.DjangoTemplates"}],
+)
+
+import django
+django.setup()
+
+from django.http import HttpResponse
+from django.template import engines
+from django.test.client import Client
+from django.urls import re_path
+from django_medusa.client import RequestEngine
+
+TEMPLATE = engines["django"].from_string(
+    "<html><body><h1>Page {{ n }}</h1>"
+    "{% for i in items %}<p>{{ i }}</p>{% endfor %}</body></html>"
+)
+
+
+def page(request, n):
+    return HttpResponse(TEMPLATE.render({"n": n, "items": range(20)}))
+
+
+urlpatterns = [re_path(r"^page/(\d+)/$", page)]
+
+
+def bench(client, paths):
+    start = time.time()
+    for path in paths:
+        resp = client.get(path)
+        assert resp.status_code == 200, resp.status_code
+        resp.content
+    return len(paths) / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--paths", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args()
+
+    paths = ["/page/%d/" % n for n in range(options.paths)]
+    for name, client in (("Client", Client()),
+                         ("RequestEngine", RequestEngine())):
+        best = max(bench(client, paths) for _ in range(options.repeat))
+        print("%-14s %9.1f paths/sec" % (name, best))
+
+
+if __name__ == "__main__":
+    main()
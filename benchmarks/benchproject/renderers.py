@@ -0,0 +1,14 @@
+from django.conf import settings
+from django_medusa.renderers import StaticSiteRenderer
+
+
+class PagesRenderer(StaticSiteRenderer):
+    warmup_templates = ["page.html"]
+
+    def get_paths(self):
+        return ["/"] + [
+            "/pages/%d/" % n for n in range(settings.BENCH_PAGES - 1)
+        ]
+
+
+renderers = [PagesRenderer, ]
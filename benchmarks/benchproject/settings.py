@@ -0,0 +1,56 @@
+"""
+Settings for the synthetic site used by `benchmarks/run.py`.
+
+Everything is configured through environment variables set by the runner:
+
+  * BENCH_BACKEND -- "disk", "s3" or "gae"
+  * BENCH_MULTITHREAD -- "1" to render with MEDUSA_MULTITHREAD
+  * BENCH_WARM_UP -- "0" to start pool workers without MEDUSA_WARM_UP
+  * BENCH_PAGES -- number of pages to render
+  * BENCH_VIEW_MS -- CPU time each view burns, in milliseconds
+  * BENCH_SIZE -- approximate response size, in bytes
+  * BENCH_OUTPUT_DIR -- MEDUSA_DEPLOY_DIR for the disk and GAE backends
+  * BENCH_S3_PORT -- port of the local S3 stand-in (`benchmarks/s3stub.py`)
+  * BENCH_S3_BUCKET -- bucket to render into
+  * BENCH_REPORT -- where to write the MEDUSA_REPORT_PATH timing report
+"""
+import os
+
+BACKENDS = {
+    "disk": "django_medusa.renderers.DiskStaticSiteRenderer",
+    "s3": "django_medusa.renderers.S3StaticSiteRenderer",
+    "gae": "django_medusa.renderers.GAEStaticSiteRenderer",
+}
+
+SECRET_KEY = "benchmark"
+DEBUG = False
+ALLOWED_HOSTS = ["*"]
+ROOT_URLCONF = "benchproject.urls"
+INSTALLED_APPS = ["django_medusa"]
+MIDDLEWARE = []
+DATABASES = {}
+TEMPLATES = [{
+    "BACKEND": "django.template.backends.django.DjangoTemplates",
+    "DIRS": [os.path.join(os.path.dirname(__file__), "templates")],
+}]
+
+BENCH_PAGES = int(os.environ.get("BENCH_PAGES", 1000))
+BENCH_VIEW_MS = float(os.environ.get("BENCH_VIEW_MS", 2))
+BENCH_SIZE = int(os.environ.get("BENCH_SIZE", 10000))
+
+MEDUSA_RENDERER_CLASS = BACKENDS[os.environ.get("BENCH_BACKEND", "disk")]
+MEDUSA_MULTITHREAD = os.environ.get("BENCH_MULTITHREAD") == "1"
+MEDUSA_WARM_UP = os.environ.get("BENCH_WARM_UP") != "0"
+MEDUSA_DEPLOY_DIR = os.environ.get("BENCH_OUTPUT_DIR", "/tmp/medusa-bench")
+MEDUSA_REPORT_PATH = os.environ.get("BENCH_REPORT")
+
+GAE_APP_ID = "medusa-bench"
+
+AWS_ACCESS_KEY = "benchmark"
+AWS_SECRET_ACCESS_KEY = "benchmark"
+MEDUSA_AWS_STORAGE_BUCKET_NAME = os.environ.get(
+    "BENCH_S3_BUCKET", "medusa-bench"
+)
+MEDUSA_AWS_S3_HOST = "127.0.0.1"
+MEDUSA_AWS_S3_PORT = int(os.environ.get("BENCH_S3_PORT", 5050))
+MEDUSA_AWS_S3_SECURE = False
@@ -0,0 +1,27 @@
+import time
+from django.conf import settings
+from django.http import HttpResponse
+from django.template.loader import get_template
+try:
+    from django.urls import re_path as url
+except ImportError:  # <Django 2.0.
+    from django.conf.urls import url
+
+PARAGRAPH = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4
+
+
+def page(request, n):
+    # Burn BENCH_VIEW_MS of CPU, like a view doing real work would.
+    deadline = time.time() + settings.BENCH_VIEW_MS / 1000.0
+    while time.time() < deadline:
+        pass
+    paragraphs = [PARAGRAPH] * max(1, settings.BENCH_SIZE // len(PARAGRAPH))
+    # Compiled on first use in each process, unless warmed up.
+    template = get_template("page.html")
+    return HttpResponse(template.render({"n": n, "paragraphs": paragraphs}))
+
+
+urlpatterns = [
+    url(r"^$", page, {"n": "home"}),
+    url(r"^pages/(\d+)/$", page),
+]
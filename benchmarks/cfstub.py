@@ -0,0 +1,168 @@
+"""
+A tiny in-memory stand-in for the parts of the CloudFront API that
+`S3StaticSiteRenderer` uses to invalidate paths (distribution info, creating
+invalidations and their status), so that the batching can be exercised
+without network access or credentials.
+
+    python benchmarks/cfstub.py [--port 5060] [--duration 2]
+
+Any distribution ID is accepted. Invalidations stay in progress for
+`--duration` seconds, and like CloudFront, the stub refuses new ones beyond
+3000 paths, or 15 wildcard paths, in progress at once. Each invalidation is
+printed as it's created.
+"""
+from __future__ import print_function
+import argparse
+import itertools
+import re
+import threading
+import time
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # <Python 3.
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+from xml.sax.saxutils import escape
+
+NS = "http://cloudfront.amazonaws.com/doc/2010-11-01/"
+MAX_PATHS = 3000
+MAX_WILDCARDS = 15
+
+# {distribution ID: {invalidation ID: (created at, paths)}}
+DISTRIBUTIONS = {}
+IDS = itertools.count(1)
+LOCK = threading.Lock()
+DURATION = 2
+
+_URL = re.compile(
+    r"^/[^/]+/distribution/(?P<distribution>[^/]+)"
+    r"(?:/invalidation(?:/(?P<invalidation>[^/]+))?)?$"
+)
+_PATH = re.compile(r"<Path>(.*?)</Path>")
+
+
+def _in_progress(invalidation):
+    return time.time() - invalidation[0] < DURATION
+
+
+class CloudFrontStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _parse(self):
+        match = _URL.match(self.path.split("?", 1)[0])
+        if not match:
+            return None, None
+        with LOCK:
+            invalidations = DISTRIBUTIONS.setdefault(
+                match.group("distribution"), {}
+            )
+        return invalidations, match.group("invalidation")
+
+    def _respond(self, status=200, xml=""):
+        body = ('<?xml version="1.0" encoding="UTF-8"?>' + xml).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, code, message):
+        self._respond(status, (
+            '<ErrorResponse xmlns="%s"><Error><Type>Sender</Type>'
+            '<Code>%s</Code><Message>%s</Message></Error></ErrorResponse>' % (
+                NS, code, escape(message)
+            )
+        ))
+
+    def _invalidation_xml(self, id, invalidation):
+        created, paths = invalidation
+        return (
+            '<Invalidation xmlns="%s"><Id>%s</Id><Status>%s</Status>'
+            '<CreateTime>%s</CreateTime><InvalidationBatch>%s'
+            '<CallerReference>stub</CallerReference></InvalidationBatch>'
+            '</Invalidation>' % (
+                NS, id,
+                "InProgress" if _in_progress(invalidation) else "Completed",
+                time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(created)),
+                "".join("<Path>%s</Path>" % escape(p) for p in paths)
+            )
+        )
+
+    def do_GET(self):
+        invalidations, id = self._parse()
+        if invalidations is None:
+            return self._error(404, "NoSuchResource", self.path)
+        if id:
+            if id not in invalidations:
+                return self._error(404, "NoSuchInvalidation", id)
+            return self._respond(
+                200, self._invalidation_xml(id, invalidations[id])
+            )
+        with LOCK:
+            in_progress = len([
+                i for i in invalidations.values() if _in_progress(i)
+            ])
+        self._respond(200, (
+            '<Distribution xmlns="%s"><Id>stub</Id><Status>Deployed</Status>'
+            '<LastModifiedTime>2014-01-01T00:00:00Z</LastModifiedTime>'
+            '<InProgressInvalidationBatches>%d</InProgressInvalidationBatches>'
+            '<DomainName>stub.cloudfront.net</DomainName></Distribution>' % (
+                NS, in_progress
+            )
+        ))
+
+    def do_POST(self):
+        invalidations, id = self._parse()
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if invalidations is None or id:
+            return self._error(404, "NoSuchResource", self.path)
+        paths = _PATH.findall(body.decode("utf-8"))
+        wildcards = len([p for p in paths if p.endswith("*")])
+        with LOCK:
+            running = [i for i in invalidations.values() if _in_progress(i)]
+            running_paths = sum(len(i[1]) for i in running)
+            running_wildcards = sum(
+                len([p for p in i[1] if p.endswith("*")]) for i in running
+            )
+            if running_paths + len(paths) > MAX_PATHS\
+            or running_wildcards + wildcards > MAX_WILDCARDS:
+                return self._error(
+                    400, "TooManyInvalidationsInProgress",
+                    "%d paths and %d wildcards in progress." % (
+                        running_paths, running_wildcards
+                    )
+                )
+            id = "I%d" % next(IDS)
+            invalidations[id] = (time.time(), paths)
+        print("%s: %d paths, %d wildcards (%s)" % (
+            id, len(paths), wildcards, " ".join(paths[:5]) +
+            (" ..." if len(paths) > 5 else "")
+        ))
+        self._respond(201, self._invalidation_xml(id, invalidations[id]))
+
+
+class CloudFrontStubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    global DURATION
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--port", type=int, default=5060)
+    parser.add_argument("--duration", type=float, default=DURATION,
+                        help="seconds an invalidation stays in progress")
+    options = parser.parse_args()
+    DURATION = options.duration
+    server = CloudFrontStubServer(
+        ("127.0.0.1", options.port), CloudFrontStubHandler
+    )
+    print("CloudFront stub listening on 127.0.0.1:%d" % options.port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
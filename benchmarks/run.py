@@ -0,0 +1,165 @@
+"""
+Benchmarks `staticsitegen` on a synthetic site against the disk, S3 (a local
+stand-in, see `s3stub.py`) and App Engine backends, rendering serially, with
+MEDUSA_MULTITHREAD, and with MEDUSA_MULTITHREAD but without warming up the
+workers ("cold"), and reports paths/sec, p50/p99 per-path latency, the
+time per path of the workers' first chunks and peak RSS for each
+combination.
+
+    python benchmarks/run.py [--pages 1000] [--view-ms 2] [--size 10000]
+                             [--backends disk,s3,gae]
+                             [--modes serial,multithread,cold] [--json FILE]
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.abspath(os.path.dirname(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+
+def peak_rss_mb():
+    """ Peak RSS of this process and of its (waited for) children, in MB. """
+    divisor = 1024.0 * (1024 if sys.platform == "darwin" else 1)
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    ) / divisor
+
+
+def child():
+    """ Runs `staticsitegen` once in this process and prints its numbers. """
+    import django
+    from django.core.management import call_command
+    django.setup()
+
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            start = time.time()
+            call_command("staticsitegen")
+            elapsed = time.time() - start
+        finally:
+            sys.stdout = stdout
+
+    # Per-path latencies come from the run's MEDUSA_REPORT_PATH report.
+    with open(os.environ["BENCH_REPORT"]) as f:
+        data = json.load(f)
+    totals, first_chunks = data["totals"], data["first_chunks"]
+    print(json.dumps({
+        "paths": totals["paths"],
+        "seconds": elapsed,
+        "paths_per_sec": totals["paths"] / elapsed,
+        "p50_ms": totals.get("p50", 0) * 1000,
+        "p99_ms": totals.get("p99", 0) * 1000,
+        "first_chunk_ms":
+            1000 * sum(first_chunks) / len(first_chunks) if first_chunks else 0,
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def run(backend, mode, options, env):
+    workdir = tempfile.mkdtemp(prefix="medusa-bench-")
+    try:
+        env = dict(env,
+            BENCH_BACKEND=backend,
+            BENCH_MULTITHREAD="0" if mode == "serial" else "1",
+            BENCH_WARM_UP="0" if mode == "cold" else "1",
+            BENCH_OUTPUT_DIR=os.path.join(workdir, "output"),
+            BENCH_REPORT=os.path.join(workdir, "report.json"),
+            BENCH_S3_BUCKET=os.path.basename(workdir).lower(),
+        )
+        output = subprocess.check_output(
+            [sys.executable, __file__, "--child"], env=env
+        )
+        return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--view-ms", type=float, default=2,
+                        help="CPU time burned by each view")
+    parser.add_argument("--size", type=int, default=10000,
+                        help="approximate response size in bytes")
+    parser.add_argument("--backends", default="disk,s3,gae")
+    parser.add_argument("--modes", default="serial,multithread,cold")
+    parser.add_argument("--json", help="also write the results to this file")
+    options = parser.parse_args()
+
+    if options.child:
+        return child()
+
+    env = dict(os.environ,
+        DJANGO_SETTINGS_MODULE="benchproject.settings",
+        PYTHONPATH=os.pathsep.join(
+            [BENCH_DIR, REPO_DIR] + os.environ.get("PYTHONPATH", "").split(
+                os.pathsep)
+        ).rstrip(os.pathsep),
+        BENCH_PAGES=str(options.pages),
+        BENCH_VIEW_MS=str(options.view_ms),
+        BENCH_SIZE=str(options.size),
+        BENCH_S3_PORT=str(free_port()),
+    )
+
+    backends = options.backends.split(",")
+    s3stub = None
+    if "s3" in backends:
+        s3stub = subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, "s3stub.py"),
+             "--port", env["BENCH_S3_PORT"]],
+            stdout=open(os.devnull, "w")
+        )
+        time.sleep(0.5)
+
+    results = []
+    try:
+        print("%-6s %-12s %8s %10s %9s %9s %9s %9s" % (
+            "", "", "paths", "paths/sec", "p50 ms", "p99 ms", "first ms",
+            "peak MB"
+        ))
+        for backend in backends:
+            for mode in options.modes.split(","):
+                result = run(backend, mode, options, env)
+                result.update(backend=backend, mode=mode)
+                results.append(result)
+                print("%-6s %-12s %8d %10.1f %9.2f %9.2f %9.2f %9.1f" % (
+                    backend, mode, result["paths"], result["paths_per_sec"],
+                    result["p50_ms"], result["p99_ms"],
+                    result["first_chunk_ms"], result["peak_rss_mb"]
+                ))
+    finally:
+        if s3stub is not None:
+            s3stub.terminate()
+
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump({
+                "pages": options.pages,
+                "view_ms": options.view_ms,
+                "size": options.size,
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
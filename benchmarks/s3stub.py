@@ -0,0 +1,253 @@
+"""
+A tiny in-memory stand-in for the parts of the S3 API that
+`S3StaticSiteRenderer` uses (bucket HEAD/GET, ?location, ?website, paginated
+listing, object PUT, server-side copy and multipart uploads), so that the S3
+backend can be benchmarked without network access or credentials.
+
+    python benchmarks/s3stub.py [--port 5050]
+
+Any bucket name is accepted and created on first use.
+"""
+from __future__ import print_function
+import argparse
+import hashlib
+import itertools
+import re
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlparse
+except ImportError:  # <Python 3.
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+NS = "http://s3.amazonaws.com/doc/2006-03-01/"
+LAST_MODIFIED = "2014-01-01T00:00:00.000Z"
+
+# {bucket name: {key name: (etag, body)}}
+BUCKETS = {}
+# {upload ID: (bucket keys, key name, {part number: body})}
+UPLOADS = {}
+UPLOAD_IDS = itertools.count(1)
+LOCK = threading.Lock()
+
+_PART_NUMBER = re.compile(r"<PartNumber>\s*(\d+)\s*</PartNumber>")
+
+
+class S3StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _parse(self):
+        url = urlparse(self.path)
+        bucket, _, key = url.path.lstrip("/").partition("/")
+        with LOCK:
+            keys = BUCKETS.setdefault(bucket, {})
+        return keys, unquote(key), parse_qs(url.query, keep_blank_values=True)
+
+    def _respond(self, status=200, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _xml(self, xml):
+        self._respond(200, (
+            '<?xml version="1.0" encoding="UTF-8"?>' + xml
+        ).encode("utf-8"), {"Content-Type": "application/xml"})
+
+    def _error(self, status, code):
+        self._respond(status, (
+            '<?xml version="1.0" encoding="UTF-8"?><Error><Code>%s</Code>'
+            '</Error>' % code
+        ).encode("utf-8"), {"Content-Type": "application/xml"})
+
+    def do_HEAD(self):
+        keys, key, query = self._parse()
+        if not key:
+            return self._respond()
+        if key not in keys:
+            return self._respond(404)
+        etag, body = keys[key]
+        self._respond(200, headers={"ETag": '"%s"' % etag})
+
+    def do_GET(self):
+        keys, key, query = self._parse()
+        if "uploadId" in query:
+            return self._list_parts(query["uploadId"][0])
+        if key:
+            if key not in keys:
+                return self._respond(404)
+            etag, body = keys[key]
+            return self._respond(200, body, {"ETag": '"%s"' % etag})
+        if "location" in query:
+            return self._xml('<LocationConstraint xmlns="%s"/>' % NS)
+
+        prefix = query.get("prefix", [""])[0]
+        marker = query.get("marker", [""])[0]
+        max_keys = int(query.get("max-keys", ["1000"])[0])
+        with LOCK:
+            names = sorted(
+                name for name in keys
+                if name.startswith(prefix) and name > marker
+            )
+        page, truncated = names[:max_keys], len(names) > max_keys
+        contents = "".join(
+            "<Contents><Key>%s</Key><LastModified>%s</LastModified>"
+            "<ETag>&quot;%s&quot;</ETag><Size>%d</Size>"
+            "<StorageClass>STANDARD</StorageClass></Contents>" % (
+                escape(name), LAST_MODIFIED, keys[name][0], len(keys[name][1])
+            )
+            for name in page
+        )
+        self._xml(
+            '<ListBucketResult xmlns="%s"><Name>stub</Name>'
+            '<Prefix>%s</Prefix><Marker>%s</Marker><MaxKeys>%d</MaxKeys>'
+            '<IsTruncated>%s</IsTruncated>%s</ListBucketResult>' % (
+                NS, escape(prefix), escape(marker), max_keys,
+                "true" if truncated else "false", contents
+            )
+        )
+
+    def do_PUT(self):
+        keys, key, query = self._parse()
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not key or "website" in query or "acl" in query:
+            return self._respond()
+        if "partNumber" in query and "uploadId" in query:
+            return self._upload_part(
+                query["uploadId"][0], int(query["partNumber"][0]), body
+            )
+        source = self.headers.get("x-amz-copy-source")
+        if source:
+            return self._copy(keys, key, source)
+        etag = hashlib.md5(body).hexdigest()
+        with LOCK:
+            keys[key] = (etag, body)
+        self._respond(200, headers={"ETag": '"%s"' % etag})
+
+    def _copy(self, keys, key, source):
+        """ Copies the "bucket/key" named by `source` into `key`. """
+        bucket, _, name = unquote(
+            source.split("?", 1)[0].lstrip("/")
+        ).partition("/")
+        with LOCK:
+            item = BUCKETS.get(bucket, {}).get(name)
+            if item is not None:
+                keys[key] = item
+        if item is None:
+            return self._error(404, "NoSuchKey")
+        self._xml(
+            '<CopyObjectResult xmlns="%s"><LastModified>%s</LastModified>'
+            '<ETag>&quot;%s&quot;</ETag></CopyObjectResult>' % (
+                NS, LAST_MODIFIED, item[0]
+            )
+        )
+
+    def _upload_part(self, upload_id, number, body):
+        with LOCK:
+            upload = UPLOADS.get(upload_id)
+            if upload is not None:
+                upload[2][number] = body
+        if upload is None:
+            return self._error(404, "NoSuchUpload")
+        self._respond(200, headers={
+            "ETag": '"%s"' % hashlib.md5(body).hexdigest()
+        })
+
+    def _list_parts(self, upload_id):
+        with LOCK:
+            upload = UPLOADS.get(upload_id)
+            parts = sorted(upload[2].items()) if upload else []
+        if upload is None:
+            return self._error(404, "NoSuchUpload")
+        self._xml(
+            '<ListPartsResult xmlns="%s"><Bucket>stub</Bucket><Key>%s</Key>'
+            '<UploadId>%s</UploadId><IsTruncated>false</IsTruncated>%s'
+            '</ListPartsResult>' % (NS, escape(upload[1]), upload_id, "".join(
+                "<Part><PartNumber>%d</PartNumber><LastModified>%s"
+                "</LastModified><ETag>&quot;%s&quot;</ETag><Size>%d</Size>"
+                "</Part>" % (
+                    number, LAST_MODIFIED, hashlib.md5(body).hexdigest(),
+                    len(body)
+                )
+                for number, body in parts
+            ))
+        )
+
+    def do_POST(self):
+        keys, key, query = self._parse()
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if "uploads" in query:
+            with LOCK:
+                upload_id = "upload-%d" % next(UPLOAD_IDS)
+                UPLOADS[upload_id] = (keys, key, {})
+            return self._xml(
+                '<InitiateMultipartUploadResult xmlns="%s"><Bucket>stub'
+                '</Bucket><Key>%s</Key><UploadId>%s</UploadId>'
+                '</InitiateMultipartUploadResult>' % (
+                    NS, escape(key), upload_id
+                )
+            )
+        if "uploadId" not in query:
+            return self._error(400, "InvalidRequest")
+        with LOCK:
+            upload = UPLOADS.pop(query["uploadId"][0], None)
+        if upload is None:
+            return self._error(404, "NoSuchUpload")
+        keys, key, parts = upload
+        numbers = [
+            int(number)
+            for number in _PART_NUMBER.findall(body.decode("utf-8"))
+        ]
+        if not numbers or any(number not in parts for number in numbers):
+            return self._error(400, "InvalidPart")
+        # Like S3's: the MD5 of the parts' MD5s, and the number of parts.
+        etag = "%s-%d" % (hashlib.md5(b"".join(
+            hashlib.md5(parts[number]).digest() for number in numbers
+        )).hexdigest(), len(numbers))
+        with LOCK:
+            keys[key] = (etag, b"".join(parts[number] for number in numbers))
+        self._xml(
+            '<CompleteMultipartUploadResult xmlns="%s"><Location>/%s'
+            '</Location><Bucket>stub</Bucket><Key>%s</Key>'
+            '<ETag>&quot;%s&quot;</ETag></CompleteMultipartUploadResult>' % (
+                NS, escape(key), escape(key), etag
+            )
+        )
+
+    def do_DELETE(self):
+        keys, key, query = self._parse()
+        if "uploadId" in query:
+            with LOCK:
+                UPLOADS.pop(query["uploadId"][0], None)
+        elif key:
+            with LOCK:
+                keys.pop(key, None)
+        self._respond(204)
+
+
+class S3StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--port", type=int, default=5050)
+    options = parser.parse_args()
+    server = S3StubServer(("127.0.0.1", options.port), S3StubHandler)
+    print("S3 stub listening on 127.0.0.1:%d" % options.port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Request engines used by the renderers to turn a URL path into a response.
+
+By default the renderers use Django's test `Client`. Setting
+`MEDUSA_CLIENT_CLASS = "django_medusa.client.RequestEngine"` switches them to
+the leaner `RequestEngine` below, which calls Django's request handler
+directly instead of going through the test client's instrumentation.
+"""
+from importlib import import_module
+from io import BytesIO
+import sys
+from django.conf import settings
+from django.core.handlers.base import BaseHandler
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.signals import request_finished
+from django.db import close_old_connections
+try:
+    from django.urls import set_script_prefix
+except ImportError:  # <Django 1.10.
+    from django.core.urlresolvers import set_script_prefix
+try:
+    from urllib.parse import unquote_to_bytes
+except ImportError:  # <Python 3.
+    from urllib import unquote as unquote_to_bytes
+
+__all__ = ('RequestEngine', 'ResponseError', 'get_client')
+
+DEFAULT_CLIENT = 'django.test.client.Client'
+
+# One client per process: pool workers reuse it for every path they render.
+_client = None
+
+
+class ResponseError(Exception):
+    """ Raised by the render functions for a response other than 200. """
+    def __init__(self, path, status_code):
+        super(ResponseError, self).__init__(
+            "%s returned status %d" % (path, status_code)
+        )
+        self.path = path
+        self.status_code = status_code
+
+
+class RequestEngine(BaseHandler):
+    """
+    A minimal stand-in for `django.test.client.Client` that only supports
+    `get()`.
+
+    Middleware is loaded once and every request is built from the same
+    prepared WSGI environ. There is no cookie jar, no session handling and
+    no template-rendered signal instrumentation, and the `request_started`
+    and `request_finished` signals are not used to recycle database
+    connections between paths.
+    """
+    def __init__(self, **defaults):
+        super(RequestEngine, self).__init__()
+        self.load_middleware()
+        script_name = getattr(settings, "FORCE_SCRIPT_NAME", None) or ""
+        set_script_prefix(script_name or "/")
+        self.base_environ = {
+            "PATH_INFO": "/",
+            "QUERY_STRING": "",
+            "REMOTE_ADDR": "127.0.0.1",
+            "REQUEST_METHOD": "GET",
+            "SCRIPT_NAME": script_name,
+            "SERVER_NAME": "testserver",
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.errors": sys.stderr,
+            "wsgi.multiprocess": True,
+            "wsgi.multithread": False,
+            "wsgi.run_once": False,
+        }
+        self.base_environ.update(defaults)
+
+    def get(self, path, **extra):
+        path, _, query_string = path.partition("?")
+        path = unquote_to_bytes(path)
+        if not isinstance(path, str):
+            path = path.decode("iso-8859-1")
+
+        environ = self.base_environ.copy()
+        environ["PATH_INFO"] = path
+        environ["QUERY_STRING"] = query_string
+        environ["wsgi.input"] = BytesIO()
+        environ.update(extra)
+
+        response = self.get_response(WSGIRequest(environ))
+
+        # Emulate a WSGI server by closing the response once its content has
+        # been consumed, without letting `close_old_connections` drop the
+        # database connection after every path.
+        if response.streaming:
+            response.streaming_content = _closing_iterator(
+                response.streaming_content, response.close
+            )
+        else:
+            request_finished.disconnect(close_old_connections)
+            try:
+                response.close()
+            finally:
+                request_finished.connect(close_old_connections)
+        return response
+
+
+def _closing_iterator(iterable, close):
+    try:
+        for chunk in iterable:
+            yield chunk
+    finally:
+        request_finished.disconnect(close_old_connections)
+        try:
+            close()
+        finally:
+            request_finished.connect(close_old_connections)
+
+
+def get_client():
+    """
+    Returns this process's client, creating it from MEDUSA_CLIENT_CLASS on
+    first use.
+    """
+    global _client
+    if _client is None:
+        client_name = getattr(settings, "MEDUSA_CLIENT_CLASS", DEFAULT_CLIENT)
+        mod_path, cls_name = client_name.rsplit('.', 1)
+        _client = getattr(import_module(mod_path), cls_name)()
+    return _client
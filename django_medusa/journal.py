@@ -0,0 +1,73 @@
+"""
+A checkpoint journal of the paths completed during a `staticsitegen` run.
+
+Every collected result is appended to the journal as one line of JSON, so
+that after a crash (or after fixing the paths that failed),
+`staticsitegen --resume` hands the journaled results straight back to
+`collect_result` instead of rendering those paths again.
+"""
+import json
+import os
+import threading
+
+__all__ = ('Journal', 'journal')
+
+
+class Journal(object):
+    """
+    Maps paths to the (JSON-serializable) results they were collected with.
+    Does nothing until `open` is called.
+    """
+    def __init__(self):
+        self.file = None
+        self.path = None
+        self.completed = {}
+        self.lock = threading.Lock()
+
+    def open(self, path, resume=False):
+        """
+        Starts journaling to `path`. With `resume`, the results already in
+        it are loaded and new ones are appended; otherwise it starts empty.
+        """
+        self.path = path
+        self.completed = {}
+        if resume and os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by the crash we resume from.
+                        continue
+                    self.completed[entry["path"]] = entry["result"]
+        self.file = open(path, "a" if resume else "w")
+
+    def get(self, path):
+        """
+        Returns `(True, result)` if `path` was completed by a previous
+        attempt of this run, `(False, None)` otherwise.
+        """
+        if path in self.completed:
+            return True, self.completed[path]
+        return False, None
+
+    def add(self, path, result):
+        if self.file is None:
+            return
+        line = json.dumps({"path": path, "result": result})
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self, remove=False):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        self.completed = {}
+        if remove:
+            os.remove(self.path)
+
+
+# The journal of the current run.
+journal = Journal()
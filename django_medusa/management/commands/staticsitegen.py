@@ -1,6 +1,13 @@
-from django.core.management.base import BaseCommand
+from __future__ import print_function
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django_medusa.journal import journal
 from django_medusa.renderers import StaticSiteRenderer
+from django_medusa.report import report
+from django_medusa.scheduler import create_pool, render_all
 from django_medusa.utils import get_static_renderers
+import json
+import os
 
 
 class Command(BaseCommand):
@@ -9,11 +16,137 @@ class Command(BaseCommand):
     help = 'Looks for \'renderers.py\' in each INSTALLED_APP, which defines '\
            'a class for processing one or more URL paths into static files.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--shard-count", type=int, default=1,
+            help="Split the paths of all renderers into this many shards, "
+                 "to be rendered on separate machines."
+        )
+        parser.add_argument(
+            "--shard-index", type=int, default=0,
+            help="The shard (0 to shard count - 1) to render."
+        )
+        parser.add_argument(
+            "--shard-dir",
+            default=getattr(settings, "MEDUSA_SHARD_DIR", "medusa-shards"),
+            help="Directory that shard results are written to and merged "
+                 "from (default: MEDUSA_SHARD_DIR, or ./medusa-shards)."
+        )
+        parser.add_argument(
+            "--resume", action="store_true",
+            help="Continue an interrupted (or partly failed) run: paths in "
+                 "its journal are not rendered again."
+        )
+        parser.add_argument(
+            "--journal",
+            default=getattr(settings, "MEDUSA_JOURNAL_PATH",
+                            "medusa-journal.jsonl"),
+            help="Where to journal completed paths (default: "
+                 "MEDUSA_JOURNAL_PATH, or ./medusa-journal.jsonl)."
+        )
+        parser.add_argument(
+            "--merge", action="store_true",
+            help="Don't render anything; finalize the output once from the "
+                 "results of all shards."
+        )
+
+    def get_shard_path(self, shard_dir, index, count):
+        return os.path.join(shard_dir, "shard-%d-of-%d.json" % (index, count))
+
     def handle(self, *args, **options):
+        shard_count = options["shard_count"]
+        shard_index = options["shard_index"]
+        if shard_count < 1 or not 0 <= shard_index < shard_count:
+            raise CommandError(
+                "--shard-index must be between 0 and --shard-count - 1."
+            )
+        StaticSiteRenderer.shard_index = shard_index
+        StaticSiteRenderer.shard_count = shard_count
+
+        if options["merge"]:
+            self.merge(options["shard_dir"], shard_count)
+            self.check_failures()
+            return
+
+        journal_path = options["journal"]
+        if shard_count > 1:
+            root, ext = os.path.splitext(journal_path)
+            journal_path = "%s.shard-%d-of-%d%s" % (
+                root, shard_index, shard_count, ext
+            )
+        journal.open(journal_path, resume=options["resume"])
+        StaticSiteRenderer.resuming = options["resume"]
+        self.render(options)
+        # Keep the journal around to resume from, unless the run went
+        # through without failures. (If rendering raised, it stays as is.)
+        journal.close(remove=not report.failures)
+        self.check_failures()
+
+    def render(self, options):
+        shard_count = options["shard_count"]
+        shard_index = options["shard_index"]
+
         StaticSiteRenderer.initialize_output()
+        if journal.completed:
+            print("Resuming: %d paths were completed by a previous "
+                  "attempt." % len(journal.completed))
 
-        for Renderer in get_static_renderers():
-            r = Renderer()
-            r.generate()
+        renderers = [Renderer() for Renderer in get_static_renderers()]
 
+        # One pool for the whole run: the paths of every renderer go through
+        # the same workers instead of each renderer starting its own pool.
+        pool = None
+        if getattr(settings, "MEDUSA_MULTITHREAD", False)\
+        and StaticSiteRenderer.render_func is not None:
+            pool = create_pool(StaticSiteRenderer, renderers)
+        try:
+            render_all(renderers, pool)
+        except Exception:
+            if pool is not None:
+                pool.terminate()
+            raise
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        if shard_count > 1:
+            state = StaticSiteRenderer.finalize_shard()
+            if not os.path.exists(options["shard_dir"]):
+                os.makedirs(options["shard_dir"])
+            shard_path = self.get_shard_path(
+                options["shard_dir"], shard_index, shard_count
+            )
+            with open(shard_path, "w") as f:
+                json.dump(state, f)
+            print("Wrote the results of shard %d of %d to %s. Run with "
+                  "--merge once all shards are done." % (
+                      shard_index, shard_count, shard_path
+                  ))
+        else:
+            StaticSiteRenderer.finalize_output()
+
+    def check_failures(self):
+        if report.failures:
+            raise CommandError(
+                "%d paths failed. Run again with --resume to render only "
+                "those (and anything the run did not get to)."
+                % len(report.failures)
+            )
+
+    def merge(self, shard_dir, shard_count):
+        shard_paths = [
+            self.get_shard_path(shard_dir, index, shard_count)
+            for index in range(shard_count)
+        ]
+        missing = [path for path in shard_paths if not os.path.exists(path)]
+        if missing:
+            raise CommandError(
+                "Missing shard results: %s" % ", ".join(missing)
+            )
+
+        StaticSiteRenderer.merging = True
+        StaticSiteRenderer.initialize_output()
+        for shard_path in shard_paths:
+            with open(shard_path, "r") as f:
+                StaticSiteRenderer.merge_shard(json.load(f))
         StaticSiteRenderer.finalize_output()
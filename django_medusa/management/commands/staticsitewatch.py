@@ -0,0 +1,143 @@
+from __future__ import print_function
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django_medusa import watch
+from django_medusa.renderers import StaticSiteRenderer
+from django_medusa.scheduler import create_pool, render_all
+from django_medusa.utils import get_static_renderers
+import signal
+import time
+import traceback
+
+
+class Command(BaseCommand):
+    can_import_settings = True
+
+    help = 'Keeps running, rendering and publishing again just the paths '\
+           'queued by django_medusa.watch (or by --push) as they come in.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--push", nargs="+", metavar="PATH",
+            help="Don't watch; queue these paths to be rendered again by a "
+                 "running staticsitewatch, and exit."
+        )
+        parser.add_argument(
+            "--renderer", metavar="NAME",
+            help="With --push: the renderer class the paths belong to (its "
+                 "dotted or class name), so the watcher doesn't have to look "
+                 "them up among the paths of every renderer."
+        )
+
+    def handle(self, *args, **options):
+        self.renderers = get_static_renderers()
+        if not self.renderers:
+            raise CommandError(
+                "No renderers found. Register a StaticSiteRenderer in the "
+                "renderers.py of your project or of an installed app."
+            )
+        self.by_name = dict(
+            (watch.get_renderer_name(Renderer), Renderer)
+            for Renderer in self.renderers
+        )
+        if options["push"]:
+            renderer = None
+            if options["renderer"]:
+                renderer = self.find_renderer(options["renderer"])
+            elif len(self.renderers) == 1:
+                renderer = self.renderers[0]
+            watch.push(options["push"], renderer)
+            return
+
+        interval = getattr(settings, "MEDUSA_WATCH_INTERVAL", 1.0)
+        StaticSiteRenderer.partial = True
+        self.owners = None
+
+        # The pool is started once, so that every batch finds its workers
+        # warmed up.
+        pool = None
+        if getattr(settings, "MEDUSA_MULTITHREAD", False)\
+        and StaticSiteRenderer.render_func is not None:
+            pool = create_pool(StaticSiteRenderer,
+                               [Renderer() for Renderer in self.renderers])
+
+        def stop(signum, frame):
+            raise KeyboardInterrupt
+        signal.signal(signal.SIGTERM, stop)
+
+        print("Watching %s for paths to render..." % watch.get_queue_dir())
+        try:
+            while True:
+                events = watch.pop()
+                if not events:
+                    time.sleep(interval)
+                    continue
+                try:
+                    self.render(events, pool)
+                except Exception:
+                    # E.g. the backend's storage being unreachable: try the
+                    # same paths again later. (Paths that merely fail to
+                    # render are in the report instead.)
+                    traceback.print_exc()
+                    for name, path in events:
+                        watch.push([path], self.by_name.get(name))
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+        finally:
+            # A second SIGTERM ends it for good.
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def find_renderer(self, name):
+        """ Returns the renderer class with the dotted or class `name`. """
+        for Renderer in self.renderers:
+            if name in (watch.get_renderer_name(Renderer), Renderer.__name__):
+                return Renderer
+        raise CommandError("No renderer named %s; the renderers are: %s." % (
+            name, ", ".join(sorted(self.by_name))
+        ))
+
+    def get_owner(self, path):
+        """
+        Returns the renderer class whose `get_paths` includes `path`, or the
+        first one if none does. Only called for paths queued without their
+        renderer.
+
+        The paths of every renderer are looked up the first time, and again
+        (at most once per batch) for a path they didn't include, e.g. a page
+        added since.
+        """
+        if self.owners is None\
+        or (path not in self.owners and not self.owners_refreshed):
+            self.owners = {}
+            for Renderer in reversed(self.renderers):
+                for renderer_path in Renderer().get_paths():
+                    self.owners[renderer_path] = Renderer
+            self.owners_refreshed = True
+        if path not in self.owners:
+            print("No renderer lists %s; rendering it with %s." % (
+                path, self.renderers[0].__name__
+            ))
+        return self.owners.get(path, self.renderers[0])
+
+    def render(self, events, pool):
+        self.owners_refreshed = False
+        batches = {}
+        for name, path in events:
+            Renderer = self.by_name.get(name) or self.get_owner(path)
+            batches.setdefault(Renderer, []).append(path)
+
+        close_old_connections()
+        StaticSiteRenderer.initialize_output()
+        renderers = []
+        for Renderer in self.renderers:
+            if Renderer in batches:
+                renderer = Renderer()
+                renderer.selected_paths = batches[Renderer]
+                renderers.append(renderer)
+        render_all(renderers, pool)
+        StaticSiteRenderer.finalize_output()
@@ -0,0 +1,12 @@
+"""
+A process-local cache for objects that a renderer's `prefetch_func` loads in
+bulk for the chunk of paths a worker is about to render, so that the views
+can look them up instead of querying for each page.
+
+It is cleared before every chunk, so it only ever holds one chunk's worth of
+objects.
+"""
+
+__all__ = ('cache', )
+
+cache = {}
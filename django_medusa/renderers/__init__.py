@@ -4,9 +4,12 @@ from .base import BaseStaticSiteRenderer
 from .disk import DiskStaticSiteRenderer
 from .appengine import GAEStaticSiteRenderer
 from .s3 import S3StaticSiteRenderer
+from .archive import ArchiveStaticSiteRenderer
+from .composite import CompositeStaticSiteRenderer
 
 __all__ = ('BaseStaticSiteRenderer', 'DiskStaticSiteRenderer',
            'S3StaticSiteRenderer', 'GAEStaticSiteRenderer',
+           'ArchiveStaticSiteRenderer', 'CompositeStaticSiteRenderer',
            'StaticSiteRenderer')
 
 
@@ -1,8 +1,12 @@
 from __future__ import print_function
 from django.conf import settings
-from django.test.client import Client
-from .base import BaseStaticSiteRenderer
+from django.core.exceptions import ImproperlyConfigured
+from ..client import ResponseError, get_client
+from ..report import record
+from .base import BaseStaticSiteRenderer, iter_content
+from .minify import minify_response
 import os
+import time
 
 __all__ = ('GAEStaticSiteRenderer', )
 
@@ -17,56 +21,76 @@ STANDARD_EXTENSIONS = (
 def _gae_render_path(args):
     client, path, view = args
     if not client:
-        client = Client()
+        client = get_client()
     if path:
-        DEPLOY_DIR = settings.MEDUSA_DEPLOY_DIR
-        realpath = path
-        if path.startswith("/"):
-            realpath = realpath[1:]
-
-        if path.endswith("/"):
-            needs_ext = True
-        else:
-            needs_ext = False
-
-        output_dir = os.path.abspath(os.path.join(
-            DEPLOY_DIR,
-            "deploy",
-            os.path.dirname(realpath)
-        ))
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        outpath = os.path.join(DEPLOY_DIR, "deploy", realpath)
-
+        start = time.time()
         resp = client.get(path)
         if resp.status_code != 200:
-            raise Exception
-
-        mimetype = resp['Content-Type'].split(";", 1)[0]
+            raise ResponseError(path, resp.status_code)
+        minify_response(path, resp)
+        return _gae_write_response(args, resp, start)
 
-        if needs_ext:
-            outpath += "index.html"
 
-        print(outpath)
-        with open(outpath, 'w') as f:
-            f.write(resp.content)
-
-        rel_outpath = outpath.replace(
-            os.path.abspath(DEPLOY_DIR) + "/",
-            ""
-        )
-        if ((not needs_ext) and path.endswith(STANDARD_EXTENSIONS))\
-        or (mimetype == "text/html"):
-            # Either has obvious extension OR it's a regular HTML file.
-            return None
-        return "# req since this url does not end in an extension and also\n"\
-               "# has non-html mime: %s\n"\
-               "- url: %s\n"\
-               "  static_files: %s\n"\
-               "  upload: %s\n"\
-               "  mime_type: %s\n\n" % (
-                    mimetype, path, rel_outpath, rel_outpath, mimetype
-               )
+def _gae_write_response(args, resp, start):
+    """
+    Writes the rendered (200) response to `path` for `_gae_render_path`, and
+    returns the app.yaml handler it needs, if any. `start` is when rendering
+    began. Also the `write_func` of `GAEStaticSiteRenderer`.
+    """
+    client, path, view = args
+    DEPLOY_DIR = settings.MEDUSA_DEPLOY_DIR
+    realpath = path
+    if path.startswith("/"):
+        realpath = realpath[1:]
+
+    if path.endswith("/"):
+        needs_ext = True
+    else:
+        needs_ext = False
+
+    outpath = os.path.join(DEPLOY_DIR, "deploy", realpath)
+
+    rendered = time.time()
+
+    mimetype = resp['Content-Type'].split(";", 1)[0]
+
+    if needs_ext:
+        outpath += "index.html"
+
+    output_dir = os.path.abspath(os.path.join(
+        DEPLOY_DIR,
+        "deploy",
+        os.path.dirname(realpath)
+    ))
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    print(outpath)
+    size = 0
+    with open(outpath, 'wb') as f:
+        # A streaming response is written out as the view produces it.
+        for chunk in iter_content(resp):
+            f.write(chunk)
+            size += len(chunk)
+    record(path, render=rendered - start,
+           write=time.time() - rendered, bytes=size)
+
+    rel_outpath = outpath.replace(
+        os.path.abspath(DEPLOY_DIR) + "/",
+        ""
+    )
+    if ((not needs_ext) and path.endswith(STANDARD_EXTENSIONS))\
+    or (mimetype == "text/html"):
+        # Either has obvious extension OR it's a regular HTML file.
+        return None
+    return "# req since this url does not end in an extension and also\n"\
+           "# has non-html mime: %s\n"\
+           "- url: %s\n"\
+           "  static_files: %s\n"\
+           "  upload: %s\n"\
+           "  mime_type: %s\n\n" % (
+                mimetype, path, rel_outpath, rel_outpath, mimetype
+           )
 
 
 class GAEStaticSiteRenderer(BaseStaticSiteRenderer):
@@ -77,29 +101,61 @@ class GAEStaticSiteRenderer(BaseStaticSiteRenderer):
     Settings:
       * GAE_APP_ID
       * MEDUSA_DEPLOY_DIR
+
+    `app.yaml` is written in `finalize_output`, once the handlers needed by
+    every path (of every shard, when sharding) are known.
     """
+    render_func = staticmethod(_gae_render_path)
+    write_func = staticmethod(_gae_write_response)
+
     def render_path(self, path=None, view=None):
         return _gae_render_path((self.client, path, view))
 
+    def get_render_args(self, path):
+        return (None, path, None)
+
     @classmethod
     def initialize_output(cls):
-        print("Initializing output directory with `app.yaml`.")
+        super(GAEStaticSiteRenderer, cls).initialize_output()
+        if cls.partial:
+            # `app.yaml` needs the handlers of every path.
+            raise ImproperlyConfigured(
+                "GAEStaticSiteRenderer can't be combined with "
+                "staticsitewatch."
+            )
+        cls.handlers = []
 
-        # Initialize the MEDUSA_DEPLOY_DIR with an `app.yaml` and `deploy`
-        # directory which stores the static files on disk.
+        # Initialize the MEDUSA_DEPLOY_DIR with a `deploy` directory which
+        # stores the static files on disk.
         DEPLOY_DIR = settings.MEDUSA_DEPLOY_DIR
         static_output_dir = os.path.abspath(os.path.join(
             DEPLOY_DIR,
             "deploy"
         ))
+        if not os.path.exists(static_output_dir):
+            os.makedirs(static_output_dir)
+
+    @classmethod
+    def finalize_shard(cls):
+        state = super(GAEStaticSiteRenderer, cls).finalize_shard()
+        state.update(handlers=cls.handlers)
+        return state
+
+    @classmethod
+    def merge_shard(cls, state):
+        super(GAEStaticSiteRenderer, cls).merge_shard(state)
+        cls.handlers += state["handlers"]
+
+    @classmethod
+    def finalize_output(cls):
+        print("Writing `app.yaml`.")
+
+        DEPLOY_DIR = settings.MEDUSA_DEPLOY_DIR
         app_yaml = os.path.abspath(os.path.join(
             DEPLOY_DIR,
             "app.yaml"
         ))
-        if not os.path.exists(static_output_dir):
-            os.makedirs(static_output_dir)
 
-        # Initialize the app.yaml file
         app_yaml_f = open(app_yaml, 'w')
         app_yaml_f.write(
             "application: %s\n"\
@@ -109,19 +165,8 @@ class GAEStaticSiteRenderer(BaseStaticSiteRenderer):
             "threadsafe: true\n\n"\
             "handlers:\n\n" % settings.GAE_APP_ID
         )
-        app_yaml_f.close()
-
-    @classmethod
-    def finalize_output(cls):
-        print("Finalizing `app.yaml`.")
-
-        DEPLOY_DIR = settings.MEDUSA_DEPLOY_DIR
-        app_yaml = os.path.abspath(os.path.join(
-            DEPLOY_DIR,
-            "app.yaml"
-        ))
-
-        app_yaml_f = open(app_yaml, 'a')
+        for handler_def in cls.handlers:
+            app_yaml_f.write(handler_def)
 
         # Handle "root" index.html pages up to 10 paths deep.
         # This is pretty awful, but it's an easy way to handle arbitrary
@@ -133,10 +178,10 @@ class GAEStaticSiteRenderer(BaseStaticSiteRenderer):
             "####################\n\n"
         )
 
-        for num_bits in xrange(10):
+        for num_bits in range(10):
             path_parts = "(.*)/" * num_bits
             counter_part = ""
-            for c in xrange(0, num_bits):
+            for c in range(0, num_bits):
                 counter_part += "\\%s/" % (c + 1)
 
             app_yaml_f.write(
@@ -160,38 +205,8 @@ class GAEStaticSiteRenderer(BaseStaticSiteRenderer):
         print("by performing the following command:")
         print("appcfg.py update %s" % os.path.abspath(DEPLOY_DIR))
 
-    def generate(self):
-        DEPLOY_DIR = settings.MEDUSA_DEPLOY_DIR
-
-        # Generate the site
-        if getattr(settings, "MEDUSA_MULTITHREAD", False):
-            # Upload up to ten items at once via `multiprocessing`.
-            from multiprocessing import Pool
-
-            print("Uploading with up to 10 upload processes...")
-            pool = Pool(10)
-
-            handlers = pool.map(
-                _gae_render_path,
-                ((None, path, None) for path in self.paths),
-                chunksize=5
-            )
-            pool.close()
-            pool.join()
-        else:
-            # Use standard, serial upload.
-            self.client = Client()
-            handlers = []
-            for path in self.paths:
-                handlers.append(self.render_path(path=path))
+        super(GAEStaticSiteRenderer, cls).finalize_output()
 
-        DEPLOY_DIR = settings.MEDUSA_DEPLOY_DIR
-        app_yaml = os.path.abspath(os.path.join(
-            DEPLOY_DIR,
-            "app.yaml"
-        ))
-        app_yaml_f = open(app_yaml, 'a')
-        for handler_def in handlers:
-            if handler_def is not None:
-                app_yaml_f.write(handler_def)
-        app_yaml_f.close()
+    def collect_result(self, result):
+        if result is not None:
+            self.handlers.append(result)
@@ -0,0 +1,289 @@
+from __future__ import print_function
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from io import BytesIO
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import stat
+import struct
+import tarfile
+import time
+import zipfile
+from ..client import ResponseError, get_client
+from ..report import record, report
+from .base import COMMON_MIME_MAPS, BaseStaticSiteRenderer, SpooledBody, \
+    iter_content, spool
+from .minify import minify_response
+
+__all__ = ('ArchiveStaticSiteRenderer', )
+
+# PAX header holding the mimetype of each tar member: the "user.mime_type"
+# extended attribute, which GNU tar restores with --xattrs. (Zip members
+# keep it in their comment.)
+MIME_HEADER = "SCHILY.xattr.user.mime_type"
+
+# Suffix of the index written next to the archive.
+INDEX_SUFFIX = ".index.json"
+
+
+def _get_archive_path():
+    return getattr(settings, "MEDUSA_ARCHIVE_PATH", None)\
+        or settings.MEDUSA_DEPLOY_DIR.rstrip(os.sep) + ".tar"
+
+
+def _get_name(path, mime):
+    """ Returns the archive member that `path` is stored as. """
+    name = path.lstrip("/")
+    if not name or name.endswith("/"):
+        # Check our override list first, and default to ".html".
+        ext = COMMON_MIME_MAPS.get(mime, mimetypes.guess_extension(mime))
+        name += "index" + (ext or ".html")
+    return name
+
+
+class _TarArchive(object):
+    """ Writes members to an uncompressed (PAX) tar file. """
+    def __init__(self, filename, mtime):
+        self.tar = tarfile.open(filename, "w", format=tarfile.PAX_FORMAT)
+        self.mtime = mtime
+
+    def _get_info(self, name, mime):
+        info = tarfile.TarInfo(name)
+        info.mtime = self.mtime
+        info.mode = 0o644
+        info.pax_headers = {MIME_HEADER: mime}
+        return info
+
+    def add(self, name, mime, size, body):
+        """
+        Adds a member with the `size` bytes of `body` (bytes or a
+        `SpooledBody`), and returns the offset of its data within the
+        archive.
+        """
+        info = self._get_info(name, mime)
+        info.size = size
+        header = info.tobuf(self.tar.format, self.tar.encoding,
+                            self.tar.errors)
+        offset = self.tar.offset + len(header)
+        f = body.open() if isinstance(body, SpooledBody) else BytesIO(body)
+        with f:
+            self.tar.addfile(info, f)
+        return offset
+
+    def link(self, name, target, mime):
+        """ Adds a member with the same contents as the member `target`. """
+        info = self._get_info(name, mime)
+        info.type = tarfile.LNKTYPE
+        info.linkname = target
+        self.tar.addfile(info)
+
+    def close(self):
+        self.tar.close()
+
+
+class _ZipArchive(object):
+    """
+    Writes members to a zip file, uncompressed so that they can be served
+    straight from their offsets.
+    """
+    def __init__(self, filename, mtime):
+        self.zip = zipfile.ZipFile(filename, "w", zipfile.ZIP_STORED,
+                                   allowZip64=True)
+        self.mtime = mtime
+        self.date_time = time.localtime(mtime)[:6]
+
+    def _get_info(self, name, mime, mode):
+        info = zipfile.ZipInfo(name, date_time=self.date_time)
+        info.create_system = 3  # Unix, for the permissions below.
+        info.external_attr = mode << 16
+        info.comment = mime.encode("utf-8")
+        return info
+
+    def _get_data_offset(self, info):
+        """ Returns the offset of the data of the member just written. """
+        position = self.zip.fp.tell()
+        # Lengths of the name and extra field, at the end of the fixed
+        # 30 bytes of the local header.
+        self.zip.fp.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<HH", self.zip.fp.read(4))
+        self.zip.fp.seek(position)
+        return info.header_offset + 30 + name_length + extra_length
+
+    def add(self, name, mime, size, body):
+        """
+        Adds a member with the `size` bytes of `body` (bytes or a
+        `SpooledBody`), and returns the offset of its data within the
+        archive.
+        """
+        mode = stat.S_IFREG | 0o644
+        if not isinstance(body, SpooledBody):
+            info = self._get_info(name, mime, mode)
+            self.zip.writestr(info, body)
+            return self._get_data_offset(info)
+
+        # `write` copies the file in chunks, but takes the member's
+        # modification time from the file's (it goes in the local header).
+        # The rest only goes in the central directory, written on close.
+        os.utime(body.filename, (self.mtime, self.mtime))
+        self.zip.write(body.filename, name)
+        info = self.zip.filelist[-1]
+        info.create_system = 3
+        info.external_attr = mode << 16
+        info.comment = mime.encode("utf-8")
+        return self._get_data_offset(info)
+
+    def link(self, name, target, mime):
+        """
+        Adds a symlink to the member `target`, which `unzip` restores as
+        such.
+        """
+        info = self._get_info(name, mime, stat.S_IFLNK | 0o777)
+        self.zip.writestr(
+            info, posixpath.relpath(target, posixpath.dirname(name) or ".")
+        )
+
+    def close(self):
+        self.zip.close()
+
+
+ARCHIVE_FORMATS = {
+    ".tar": _TarArchive,
+    ".zip": _ZipArchive,
+}
+
+
+def _archive_render_path(args):
+    client, path, view = args
+    if not client:
+        client = get_client()
+
+    start = time.time()
+    resp = client.get(path)
+    if resp.status_code != 200:
+        raise ResponseError(path, resp.status_code)
+    minify_response(path, resp)
+    return _archive_write_response(args, resp, start)
+
+
+def _archive_write_response(args, resp, start):
+    """
+    Returns the rendered (200) response of `path` as the main process adds
+    it to the archive. `start` is when rendering began. Also the
+    `write_func` of `ArchiveStaticSiteRenderer`.
+    """
+    client, path, view = args
+    mime = resp['Content-Type'].split(";", 1)[0]
+
+    digest = hashlib.sha1()
+    if resp.streaming:
+        # Only the main process writes to the archive; hand it the body
+        # through a temporary file rather than in memory.
+        body = spool(iter_content(resp), digest)
+        size = body.size
+    else:
+        body = resp.content
+        digest.update(body)
+        size = len(body)
+    record(path, render=time.time() - start, bytes=size)
+    return path, _get_name(path, mime), mime, digest.hexdigest(), size, body
+
+
+class ArchiveStaticSiteRenderer(BaseStaticSiteRenderer):
+    """
+    Writes the rendered paths into a single archive, instead of one file
+    per path, to spare the filesystem (and whatever ships the site to the
+    web servers) hundreds of thousands of small files. Pool workers render;
+    the main process appends what they return to the archive.
+
+    Each member keeps the mimetype of its response (as a `user.mime_type`
+    extended attribute for tar, in the member's comment for zip). A body
+    identical to one already in the archive is stored as a link to it (a
+    hardlink for tar, a symlink for zip) instead of a second copy.
+
+    Next to the archive, `<archive>.index.json` maps every path to its
+    member's name, mimetype, size, SHA-1 and the offset of its data within
+    the archive, so that it can be served or extracted without a scan.
+
+    Both are written to temporary files and moved into place once rendering
+    is done. The archive is rewritten from scratch every run, so `--resume`
+    renders everything again, and neither sharding nor `staticsitewatch` is
+    supported.
+
+    Settings:
+      * MEDUSA_ARCHIVE_PATH (default: MEDUSA_DEPLOY_DIR + ".tar") -- ends in
+        ".tar" or ".zip".
+    """
+    render_func = staticmethod(_archive_render_path)
+    write_func = staticmethod(_archive_write_response)
+
+    @classmethod
+    def initialize_output(cls):
+        super(ArchiveStaticSiteRenderer, cls).initialize_output()
+        if cls.shard_count > 1 or cls.partial:
+            raise ImproperlyConfigured(
+                "ArchiveStaticSiteRenderer always renders the whole site, "
+                "so it can't be combined with sharding or staticsitewatch."
+            )
+        cls.archive_path = _get_archive_path()
+        ext = os.path.splitext(cls.archive_path)[1].lower()
+        if ext not in ARCHIVE_FORMATS:
+            raise ImproperlyConfigured(
+                "MEDUSA_ARCHIVE_PATH must end in one of: %s" %
+                ", ".join(sorted(ARCHIVE_FORMATS))
+            )
+        directory = os.path.dirname(os.path.abspath(cls.archive_path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        cls.archive = ARCHIVE_FORMATS[ext](cls.archive_path + ".tmp",
+                                           int(time.time()))
+        cls.index = {}
+        # SHA-1 -> index entry of the member that stores that body.
+        cls.bodies = {}
+
+    @classmethod
+    def finalize_output(cls):
+        cls.archive.close()
+        os.rename(cls.archive_path + ".tmp", cls.archive_path)
+        index_path = cls.archive_path + INDEX_SUFFIX
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(cls.index, f, separators=(',', ':'), sort_keys=True)
+        os.rename(index_path + ".tmp", index_path)
+        duplicates = sum(1 for entry in cls.index.values() if "link" in entry)
+        print("Archived %d paths (%d duplicates stored once) to %s." % (
+            len(cls.index), duplicates, cls.archive_path
+        ))
+
+        super(ArchiveStaticSiteRenderer, cls).finalize_output()
+
+    def get_render_args(self, path):
+        return (None, path, None)
+
+    def render_path(self, path=None, view=None):
+        return _archive_render_path((self.client, path, view))
+
+    def collect_result(self, result):
+        path, name, mime, digest, size, body = result
+        cls = type(self)
+        start = time.time()
+        entry = {"name": name, "mime": mime, "size": size, "hash": digest}
+        original = cls.bodies.get(digest)
+        if original is not None:
+            cls.archive.link(name, original["name"], mime)
+            entry.update(offset=original["offset"], link=original["name"])
+        else:
+            entry["offset"] = cls.archive.add(name, mime, size, body)
+            cls.bodies[digest] = entry
+        if isinstance(body, SpooledBody):
+            body.remove()
+        cls.index[path] = entry
+        if not self.as_sink:
+            report.add_body(digest, size)
+        report.add(None, path, {"archive": time.time() - start})
+
+    def journal_result(self, path, result):
+        # The archive is written from scratch every run, so there is nothing
+        # to resume from.
+        pass
@@ -1,4 +1,22 @@
-__all__ = ['COMMON_MIME_MAPS', 'BaseStaticSiteRenderer']
+from django.conf import settings
+from io import BytesIO
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from ..journal import journal
+from ..report import report
+from ..scheduler import create_pool, render_all
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__all__ = ['COMMON_MIME_MAPS', 'COMPRESSED_VARIANTS', 'STREAM_CHUNK_SIZE',
+           'BaseStaticSiteRenderer', 'SpooledBody', 'get_conditional_headers',
+           'get_shard', 'get_validators', 'gzip_compress', 'iter_content',
+           'open_compressor', 'should_precompress', 'spool']
 
 
 # Since mimetypes.get_extension() gets the "first known" (alphabetically),
@@ -16,12 +34,290 @@ COMMON_MIME_MAPS = {
 }
 
 
+def gzip_compress(content):
+    """
+    Gzips `content` without a timestamp, so that the same input always
+    compresses to the same bytes (and thus the same hash/ETag).
+    """
+    buf = BytesIO()
+    with gzip.GzipFile(filename="", mode="wb", compresslevel=9,
+                       fileobj=buf, mtime=0) as f:
+        f.write(content)
+    return buf.getvalue()
+
+
+# (file extension, Content-Encoding, compress function) of each precompressed
+# variant generated alongside a compressible file. Brotli needs `brotli`.
+COMPRESSED_VARIANTS = [(".gz", "gzip", gzip_compress)]
+if brotli is not None:
+    COMPRESSED_VARIANTS.append((".br", "br", brotli.compress))
+
+
+class _BrotliWriter(object):
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.compressor = brotli.Compressor()
+        # `brotli` calls it `process`, `brotlipy` calls it `compress`.
+        self.process = getattr(self.compressor, "process", None)\
+            or self.compressor.compress
+
+    def write(self, data):
+        self.fileobj.write(self.process(data))
+
+    def close(self):
+        self.fileobj.write(self.compressor.finish())
+
+
+def open_compressor(encoding, fileobj):
+    """
+    Returns a file-like object that compresses what is written to it into
+    `fileobj`, with the Content-Encoding of one of COMPRESSED_VARIANTS, for
+    bodies too large to compress in memory. Closing it leaves `fileobj` open.
+    """
+    if encoding == "gzip":
+        return gzip.GzipFile(filename="", mode="wb", compresslevel=9,
+                             fileobj=fileobj, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return _BrotliWriter(fileobj)
+    raise ValueError("Unknown encoding: %s" % encoding)
+
+
+def should_precompress(mimetype, size):
+    """
+    Whether a body of the given mimetype and size should be precompressed:
+    only with MEDUSA_PRECOMPRESS, for the text types in COMMON_MIME_MAPS, and
+    for bodies of at least MEDUSA_PRECOMPRESS_MIN_SIZE bytes (default: 1024).
+    A size of None (a streamed body of unknown length) counts as large.
+    """
+    return getattr(settings, "MEDUSA_PRECOMPRESS", False)\
+        and mimetype in COMMON_MIME_MAPS\
+        and (size is None or
+             size >= getattr(settings, "MEDUSA_PRECOMPRESS_MIN_SIZE", 1024))
+
+
+# How much of a streamed body (see `iter_content`) is read, written or
+# compressed at a time.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def iter_content(response):
+    """
+    Yields the body of `response` in pieces: as the view produces it for a
+    `StreamingHttpResponse` (so that it never has to be in memory as a
+    whole), in one piece otherwise.
+    """
+    if getattr(response, "streaming", False):
+        for chunk in response.streaming_content:
+            yield chunk
+    else:
+        yield response.content
+
+
+class SpooledBody(object):
+    """
+    A streamed body, spooled to a temporary file by a render worker (see
+    `spool`) for the main process to read and remove, so that it never has
+    to be in memory (or pickled back from the worker) as a whole.
+    """
+    def __init__(self, filename, size):
+        self.filename = filename
+        self.size = size
+
+    def open(self):
+        return open(self.filename, 'rb')
+
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+class _HashingWriter(object):
+    def __init__(self, fileobj, digest):
+        self.fileobj = fileobj
+        self.digest = digest
+
+    def write(self, data):
+        self.digest.update(data)
+        self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+def spool(chunks, digest, encoding=None):
+    """
+    Writes `chunks` (compressed with `encoding`, if given) to a temporary
+    file in MEDUSA_SPOOL_DIR (default: the system's temporary directory),
+    feeding what is written to `digest` (e.g. a `hashlib` object) on the
+    way. Returns a `SpooledBody`.
+    """
+    fd, filename = tempfile.mkstemp(
+        prefix="medusa-", dir=getattr(settings, "MEDUSA_SPOOL_DIR", None)
+    )
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            writer = _HashingWriter(f, digest)
+            if encoding:
+                writer = open_compressor(encoding, writer)
+            for chunk in chunks:
+                writer.write(chunk)
+            if encoding:
+                writer.close()
+            size = f.tell()
+    except BaseException:
+        os.remove(filename)
+        raise
+    return SpooledBody(filename, size)
+
+
+# Response headers kept from one run to make the next run's request for the
+# same path conditional: {key: (response header, request header)}.
+VALIDATORS = {
+    "etag": ("ETag", "HTTP_IF_NONE_MATCH"),
+    "last_modified": ("Last-Modified", "HTTP_IF_MODIFIED_SINCE"),
+}
+
+
+def _get_output_settings():
+    """
+    Returns a digest of the settings that change what is stored for the same
+    response (minification and precompression), so that a 304 doesn't keep
+    a page as it was written under other settings.
+    """
+    from .minify import DEFAULT_MINIFIERS
+    minifiers = {}
+    if getattr(settings, "MEDUSA_MINIFY", False):
+        minifiers = dict(
+            (key, [
+                name if not callable(name)
+                else "%s.%s" % (name.__module__, name.__name__)
+                for name in names
+            ])
+            for key, names in getattr(
+                settings, "MEDUSA_MINIFIERS", DEFAULT_MINIFIERS
+            ).items()
+        )
+    precompress = None
+    if getattr(settings, "MEDUSA_PRECOMPRESS", False):
+        precompress = [
+            getattr(settings, "MEDUSA_PRECOMPRESS_MIN_SIZE", 1024),
+            [ext for ext, encoding, compress in COMPRESSED_VARIANTS],
+        ]
+    return hashlib.md5(json.dumps(
+        [minifiers, precompress], sort_keys=True
+    ).encode("utf-8")).hexdigest()
+
+
+def get_validators(response):
+    """
+    Returns the validators (ETag, Last-Modified) of `response` as a dict, to
+    be stored until the next run, along with the output settings they were
+    stored under.
+    """
+    validators = dict(
+        (key, response[header])
+        for key, (header, request_header) in VALIDATORS.items()
+        if response.has_header(header)
+    )
+    if validators:
+        validators["output"] = _get_output_settings()
+    return validators
+
+
+def get_conditional_headers(validators):
+    """
+    Returns the request headers (as `client.get` keyword arguments) that ask
+    for a 304 if the response still matches the stored `validators`. Empty
+    with MEDUSA_CONDITIONAL = False, and if the output settings changed
+    since the validators were stored.
+    """
+    if not validators or not getattr(settings, "MEDUSA_CONDITIONAL", True)\
+    or validators.get("output") != _get_output_settings():
+        return {}
+    return dict(
+        (request_header, validators[key])
+        for key, (header, request_header) in VALIDATORS.items()
+        if validators.get(key)
+    )
+
+
+def get_shard(path, shard_count):
+    """
+    Returns the shard (out of `shard_count`) that renders `path`. Stable
+    across processes and machines, unlike `hash()`.
+    """
+    digest = hashlib.md5(path.encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) % shard_count
+
+
 class BaseStaticSiteRenderer(object):
     """
     This default renderer writes the given URLs (defined in get_paths())
     into static files on the filesystem by getting the view's response
     through the Django testclient.
+
+    Backends that support `MEDUSA_MULTITHREAD` set `render_func` to a
+    module-level function that renders one path in a pool worker, given the
+    tuple returned by `get_render_args`.
     """
+    # Rendering function run inside pool workers, see `get_render_args`.
+    render_func = None
+
+    # Function that does what `render_func` does with a response rendered
+    # elsewhere (by `CompositeStaticSiteRenderer`): called in the worker with
+    # the tuple from `get_render_args`, the (200) response and the time
+    # rendering began, it returns the result for `collect_result`.
+    write_func = None
+
+    # Optional function called with the list of paths of each chunk before
+    # they are rendered (in the worker, or in this process without a pool),
+    # to bulk-load what their views need into `django_medusa.prefetch.cache`.
+    prefetch_func = None
+
+    # What pool workers prepare as they start (see `scheduler.warm_up`):
+    # templates to load, and an optional module-level function to call.
+    warmup_templates = ()
+    warmup_func = None
+
+    # Default pool size (None: one process per CPU) and the number of paths
+    # handed to a worker at a time (None: tuned while rendering, see
+    # `django_medusa.tuner`). MEDUSA_PROCESSES overrides the former.
+    processes = None
+    chunksize = None
+
+    # When True (or with MEDUSA_STREAM_PATHS), get_paths() is consumed lazily
+    # while rendering instead of being materialized first, so it can be a
+    # generator over millions of rows.
+    stream_paths = False
+
+    # Set by `staticsitegen --shard-index/--shard-count`: only the paths for
+    # which `get_shard(path, shard_count) == shard_index` are rendered. While
+    # `merging`, `initialize_output` and `finalize_output` run without
+    # rendering anything, around `merge_shard` calls.
+    shard_index = 0
+    shard_count = 1
+    merging = False
+
+    # Set by `staticsitegen --resume`: paths completed by the interrupted
+    # attempt are replayed from the journal rather than rendered again.
+    resuming = False
+
+    # Set by `staticsitewatch`: each run renders only the paths that changed,
+    # so backends must keep (and publish) everything else as it is.
+    partial = False
+
+    # Set on an instance (by `staticsitewatch`) to render just these paths
+    # instead of those from get_paths().
+    selected_paths = None
+
+    # Set by `CompositeStaticSiteRenderer` on the backends it writes to: the
+    # run's report (timings, failures, dedupe counts) is then left to it.
+    as_sink = False
+
+    # Models whose instances `django_medusa.watch` reports changes of (when
+    # saved or deleted) to `get_changed_paths`.
+    watch_models = ()
 
     @classmethod
     def initialize_output(cls):
@@ -32,8 +328,11 @@ class BaseStaticSiteRenderer(object):
 
         Management command calls this once before iterating over all
         renderer instances.
+
+        Subclasses should call this (via super) to start a new timing report.
         """
-        pass
+        if not cls.as_sink:
+            report.reset()
 
     @classmethod
     def finalize_output(cls):
@@ -45,25 +344,169 @@ class BaseStaticSiteRenderer(object):
 
         Management command calls this once after iterating over all
         renderer instances.
+
+        Subclasses should call this (via super) once they are done, to write
+        the timing report (see MEDUSA_REPORT_PATH).
         """
-        pass
+        if not cls.as_sink:
+            report.finish()
+
+    @classmethod
+    def finalize_shard(cls):
+        """
+        Called instead of `finalize_output` at the end of a sharded run.
+        Should do whatever has to happen on this machine (e.g. waiting for
+        uploads) and return this shard's partial result as a JSON-serializable
+        dict, for `merge_shard`.
+
+        Subclasses should add their own keys to the dict returned via super.
+        """
+        if cls.as_sink:
+            return {}
+        report.finish()
+        return {"report": {
+            "started": report.started,
+            "paths": report.paths,
+            "failures": report.failures,
+            "first_chunks": report.first_chunks,
+            "dedupe": report.dedupe,
+            "minified": report.minified,
+        }}
+
+    @classmethod
+    def merge_shard(cls, state):
+        """
+        Called while merging, between `initialize_output` and
+        `finalize_output`, with the result of `finalize_shard` of each shard.
+        """
+        if cls.as_sink:
+            return
+        report.started = min(report.started, state["report"]["started"])
+        report.paths.update(state["report"]["paths"])
+        report.failures += state["report"]["failures"]
+        report.first_chunks += state["report"]["first_chunks"]
+        # Only duplicates within each shard are known.
+        for name, value in state["report"]["dedupe"].items():
+            report.dedupe[name] += value
+        for mimetype, totals in state["report"]["minified"].items():
+            report.add_minified(mimetype, totals["bytes"],
+                                totals["bytes"] - totals["bytes_saved"],
+                                totals["bodies"])
 
     def get_paths(self):
         """ Override this in a subclass to define the URLs to process """
         raise NotImplementedError
 
+    def get_changed_paths(self, instance):
+        """
+        Override this (along with `watch_models`) to return the paths that
+        need to be rendered again once `instance` was saved or deleted.
+        """
+        return []
+
     @property
     def paths(self):
         """ Property that memoizes get_paths. """
+        if self.selected_paths is not None:
+            return self.selected_paths
         p = getattr(self, "_paths", None)
         if not p:
             p = self.get_paths()
             self._paths = p
         return p
 
+    def is_streaming(self):
+        """ Whether get_paths() is consumed lazily, see `stream_paths`. """
+        if self.selected_paths is not None:
+            return False
+        return self.stream_paths\
+            or getattr(settings, "MEDUSA_STREAM_PATHS", False)
+
+    def get_priority(self, path):
+        """
+        Override this to have some paths rendered (and published) before
+        others: higher priorities go first. Ignored for streamed paths.
+        """
+        return 0
+
+    def iter_paths(self):
+        """
+        Returns an iterable over the paths to render: the memoized `paths`,
+        or a fresh iterator over get_paths() when streaming, limited to our
+        shard when sharding.
+        """
+        if self.is_streaming():
+            paths = iter(self.get_paths())
+        else:
+            paths = self.paths
+        if self.shard_count > 1:
+            return (path for path in paths
+                    if get_shard(path, self.shard_count) == self.shard_index)
+        return paths
+
     def render_path(self, path=None, view=None):
         raise NotImplementedError
 
-    def generate(self):
-        for path in self.paths:
-            self.render_path(path)
+    def get_render_args(self, path):
+        """
+        Returns the (picklable) argument passed to `render_func` in a pool
+        worker to render `path`.
+        """
+        raise NotImplementedError
+
+    def setup(self):
+        """ Called in the main process before any of our paths are rendered. """
+        pass
+
+    def collect_result(self, result):
+        """
+        Called in the main process with the return value of `render_path`
+        (or `render_func`, in a worker) for each rendered path.
+        """
+        pass
+
+    def journal_result(self, path, result):
+        """
+        Called in the main process after `collect_result`, once the result
+        for `path` is final, to record it in the run's journal. Results must
+        be JSON-serializable; `--resume` passes them to `collect_result`
+        again instead of rendering `path`.
+        """
+        journal.add(path, result)
+
+    def collect_journaled(self, result):
+        """
+        Called in the main process, when resuming, with a result from the
+        journal instead of rendering its path again.
+        """
+        self.collect_result(result)
+
+    def collect_failure(self, path, error):
+        """
+        Called in the main process (instead of `collect_result`) with the
+        traceback of a path that could not be rendered.
+        """
+        pass
+
+    def teardown(self):
+        """ Called in the main process after all our paths were collected. """
+        pass
+
+    def generate(self, pool=None):
+        """
+        Renders all paths of this renderer, using `pool` (or a pool of our
+        own if MEDUSA_MULTITHREAD is set) when given.
+        """
+        own_pool = pool is None and self.render_func is not None\
+            and getattr(settings, "MEDUSA_MULTITHREAD", False)
+        if own_pool:
+            pool = create_pool(type(self), [self])
+        try:
+            render_all([self], pool)
+        except Exception:
+            if own_pool:
+                pool.terminate()
+            raise
+        if own_pool:
+            pool.close()
+            pool.join()
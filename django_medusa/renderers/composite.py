@@ -0,0 +1,219 @@
+from __future__ import print_function
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+import hashlib
+import threading
+import time
+from ..client import ResponseError, get_client
+from ..report import record, report
+from .base import STREAM_CHUNK_SIZE, BaseStaticSiteRenderer, iter_content, \
+    spool
+from .minify import minify_response
+
+__all__ = ('CompositeStaticSiteRenderer', )
+
+
+def _get_sinks():
+    from . import get_cls
+    names = getattr(settings, "MEDUSA_SINKS", None)
+    if not names:
+        raise ImproperlyConfigured(
+            "CompositeStaticSiteRenderer needs MEDUSA_SINKS, the renderer "
+            "classes to write every rendered path to."
+        )
+    sinks = [get_cls(name) for name in names]
+    for Sink in sinks:
+        if Sink.write_func is None:
+            raise ImproperlyConfigured(
+                "%s can't write responses rendered by another renderer, so "
+                "it can't be used in MEDUSA_SINKS." % Sink.__name__
+            )
+    return sinks
+
+
+def _call_all(funcs):
+    """
+    Calls every function of `funcs`, each in its own thread, and returns
+    their results in the same order. Re-raises the first error, once all of
+    them are done.
+    """
+    results = [None] * len(funcs)
+    errors = []
+
+    def call(index):
+        try:
+            results[index] = funcs[index]()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call, args=(index, ))
+               for index in range(len(funcs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+class _SpooledResponse(object):
+    """
+    Stands in for a streaming response whose body was spooled to a
+    temporary file, so that every sink can read the body from the start.
+    """
+    streaming = True
+
+    def __init__(self, response, body):
+        self.response = response
+        self.body = body
+        self.status_code = response.status_code
+
+    def __getitem__(self, header):
+        return self.response[header]
+
+    def has_header(self, header):
+        return self.response.has_header(header)
+
+    @property
+    def streaming_content(self):
+        with self.body.open() as f:
+            for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+                yield chunk
+
+
+def _composite_render_path(args):
+    """
+    Renders `path` once, and hands the response to the `write_func` of each
+    sink in turn, given that sink's render args.
+    """
+    client, path, view, sinks = args
+    if not client:
+        client = get_client()
+
+    start = time.time()
+    resp = client.get(path)
+    if resp.status_code != 200:
+        raise ResponseError(path, resp.status_code)
+    minify_response(path, resp)
+    digest = hashlib.sha1()
+    body = None
+    if resp.streaming:
+        # The view produces a streamed body only once.
+        body = spool(iter_content(resp), digest)
+        size = body.size
+        resp = _SpooledResponse(resp, body)
+    else:
+        digest.update(resp.content)
+        size = len(resp.content)
+    record(path, render=time.time() - start)
+
+    try:
+        results = [write_func(sink_args, resp, time.time())
+                   for write_func, sink_args in sinks]
+    finally:
+        if body is not None:
+            body.remove()
+    return path, digest.hexdigest(), size, results
+
+
+class CompositeStaticSiteRenderer(BaseStaticSiteRenderer):
+    """
+    Renders each path once and writes the response to several backends (the
+    "sinks", e.g. a deploy directory and an S3 bucket), so that rendering
+    doesn't cost more with every destination added.
+
+    Each sink's `write_func` runs in the worker right after the path is
+    rendered, and its result goes to that sink's `collect_result` in the
+    main process as usual. The sinks' `initialize_output` and
+    `finalize_output` (e.g. the disk renderer's publishing and the S3
+    renderer's waiting for uploads) run side by side, in threads. Timings
+    of a path add up over all sinks.
+
+    Journals aren't kept per sink, so `--resume` isn't supported.
+
+    Settings:
+      * MEDUSA_SINKS -- dotted names of the renderer classes to write to,
+        e.g. `["django_medusa.renderers.DiskStaticSiteRenderer",
+        "django_medusa.renderers.S3StaticSiteRenderer"]`.
+    """
+    render_func = staticmethod(_composite_render_path)
+
+    @classmethod
+    def initialize_output(cls):
+        super(CompositeStaticSiteRenderer, cls).initialize_output()
+        if cls.resuming:
+            raise ImproperlyConfigured(
+                "CompositeStaticSiteRenderer can't resume a run; run it "
+                "again without --resume."
+            )
+        cls.sinks = _get_sinks()
+        for Sink in cls.sinks:
+            Sink.as_sink = True
+            Sink.shard_index = cls.shard_index
+            Sink.shard_count = cls.shard_count
+            Sink.merging = cls.merging
+            Sink.partial = cls.partial
+        _call_all([Sink.initialize_output for Sink in cls.sinks])
+
+    @classmethod
+    def finalize_output(cls):
+        _call_all([Sink.finalize_output for Sink in cls.sinks])
+        super(CompositeStaticSiteRenderer, cls).finalize_output()
+
+    @classmethod
+    def finalize_shard(cls):
+        states = _call_all([Sink.finalize_shard for Sink in cls.sinks])
+        state = super(CompositeStaticSiteRenderer, cls).finalize_shard()
+        state["sinks"] = states
+        return state
+
+    @classmethod
+    def merge_shard(cls, state):
+        super(CompositeStaticSiteRenderer, cls).merge_shard(state)
+        for Sink, sink_state in zip(cls.sinks, state["sinks"]):
+            Sink.merge_shard(sink_state)
+
+    def get_sink(self, Sink):
+        """ Returns an instance of `Sink` for the same paths as ours. """
+        sink = Sink()
+        sink.get_paths = self.get_paths
+        sink.stream_paths = self.is_streaming()
+        sink.selected_paths = self.selected_paths
+        if not self.is_streaming():
+            sink._paths = self.paths
+        return sink
+
+    def setup(self):
+        self.sink_renderers = [self.get_sink(Sink) for Sink in self.sinks]
+        for sink in self.sink_renderers:
+            sink.setup()
+
+    def get_render_args(self, path):
+        return (None, path, None, [
+            (sink.write_func, sink.get_render_args(path))
+            for sink in self.sink_renderers
+        ])
+
+    def render_path(self, path=None, view=None):
+        return _composite_render_path(
+            (self.client, ) + self.get_render_args(path)[1:]
+        )
+
+    def collect_result(self, result):
+        path, digest, size, results = result
+        report.add_body(digest, size)
+        for sink, sink_result in zip(self.sink_renderers, results):
+            sink.collect_result(sink_result)
+
+    def journal_result(self, path, result):
+        # See `initialize_output`.
+        pass
+
+    def collect_failure(self, path, error):
+        for sink in self.sink_renderers:
+            sink.collect_failure(path, error)
+
+    def teardown(self):
+        for sink in self.sink_renderers:
+            sink.teardown()
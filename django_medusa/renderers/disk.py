@@ -1,83 +1,603 @@
 from __future__ import print_function
 from django.conf import settings
-from django.test.client import Client
+from django.core.exceptions import ImproperlyConfigured
+from datetime import datetime
+import errno
+import hashlib
+import json
 import mimetypes
 import os
-from .base import COMMON_MIME_MAPS, BaseStaticSiteRenderer
+import shutil
+import time
+from ..client import ResponseError, get_client
+from ..report import record, report
+from .base import COMMON_MIME_MAPS, COMPRESSED_VARIANTS, STREAM_CHUNK_SIZE, \
+    BaseStaticSiteRenderer, get_conditional_headers, get_validators, \
+    iter_content, open_compressor, should_precompress
+from .minify import minify_response
 
 __all__ = ('DiskStaticSiteRenderer', )
 
+# Name of the file (inside MEDUSA_DEPLOY_DIR) that records what the previous
+# run wrote, so that unchanged files can be left alone.
+MANIFEST_NAME = ".medusa-manifest.json"
+
+
+# Staged generations live next to MEDUSA_DEPLOY_DIR, named
+# "<MEDUSA_DEPLOY_DIR>.gen-<timestamp>".
+GENERATION_SUFFIX = ".gen-"
+
+
+def _get_manifest_path(deploy_dir=None):
+    return os.path.join(deploy_dir or settings.MEDUSA_DEPLOY_DIR,
+                        MANIFEST_NAME)
+
+
+def _load_manifest():
+    try:
+        with open(_get_manifest_path(), 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest, deploy_dir=None):
+    _makedirs(deploy_dir or settings.MEDUSA_DEPLOY_DIR)
+    manifest_path = _get_manifest_path(deploy_dir)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, separators=(',', ':'), sort_keys=True)
+    os.rename(temp_path, manifest_path)
+
+
+def _get_generations(deploy_dir):
+    """ Returns the paths of all staged generations, oldest first. """
+    prefix = os.path.basename(deploy_dir) + GENERATION_SUFFIX
+    parent = os.path.dirname(os.path.abspath(deploy_dir))
+    return sorted(
+        os.path.join(parent, name) for name in os.listdir(parent)
+        if name.startswith(prefix)
+    )
+
+
+def _makedirs(path):
+    # Several workers may race to create the same directory.
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _open_file(outpath):
+    # The directory tree is usually created up front by `setup`, so only
+    # create directories when the open actually fails for lack of one.
+    try:
+        return open(outpath, 'wb')
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
+        _makedirs(os.path.dirname(outpath))
+        return open(outpath, 'wb')
+
+
+def _write_file(outpath, content):
+    with _open_file(outpath) as f:
+        f.write(content)
+
+
+def _write_stream(outpath, chunks):
+    """
+    Writes `chunks` to a temporary file next to `outpath` as they come in.
+    Returns the temporary file's path, and the SHA-1 and size of what was
+    written.
+    """
+    temp_path = outpath + ".medusa-tmp"
+    digest = hashlib.sha1()
+    size = 0
+    try:
+        with _open_file(temp_path) as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+
+def _compress_file(source, outpath, encoding):
+    """ Writes a compressed copy of `source` without reading it all in. """
+    with open(source, 'rb') as f, _open_file(outpath) as out:
+        compressor = open_compressor(encoding, out)
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+            compressor.write(chunk)
+        compressor.close()
+
+
+def _link_file(source, outpath):
+    try:
+        os.link(source, outpath)
+    except OSError as e:
+        if e.errno != errno.ENOENT or not os.path.exists(source):
+            raise
+        _makedirs(os.path.dirname(outpath))
+        os.link(source, outpath)
+
+
+def _reuse_file(source, outpath):
+    try:
+        _link_file(source, outpath)
+    except OSError:
+        # E.g. the generations are on different filesystems.
+        shutil.copy2(source, outpath)
+
+
+def _get_store_dir():
+    """
+    Returns the content store (MEDUSA_DISK_CONTENT_STORE, by default next to
+    MEDUSA_DEPLOY_DIR) if MEDUSA_DEDUPE is set, None otherwise.
+    """
+    if not getattr(settings, "MEDUSA_DEDUPE", False):
+        return None
+    return getattr(settings, "MEDUSA_DISK_CONTENT_STORE", None)\
+        or settings.MEDUSA_DEPLOY_DIR.rstrip(os.sep) + ".objects"
+
+
+def _get_object_path(store_dir, digest):
+    return os.path.join(store_dir, digest[:2], digest)
+
+
+def _link_object(store_dir, entry, outpath):
+    """
+    Hardlinks `outpath` (and its variants) to the content store's copy of
+    `entry`'s body, if it has one. Returns whether it had.
+    """
+    object_path = _get_object_path(store_dir, entry["hash"])
+    exts = [""] + entry["variants"]
+    if not all(os.path.exists(object_path + ext) for ext in exts):
+        return False
+    for ext in exts:
+        if os.path.exists(outpath + ext)\
+        and os.path.samefile(object_path + ext, outpath + ext):
+            continue
+        # Replace whatever is there in one go.
+        temp_path = outpath + ext + ".medusa-tmp"
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        _link_file(object_path + ext, temp_path)
+        os.rename(temp_path, outpath + ext)
+    return True
+
+
+def _store_object(store_dir, entry, outpath):
+    """ Adds the just written `outpath` (and variants) to the store. """
+    object_path = _get_object_path(store_dir, entry["hash"])
+    _makedirs(os.path.dirname(object_path))
+    for ext in [""] + entry["variants"]:
+        try:
+            os.link(outpath + ext, object_path + ext)
+        except OSError as e:
+            # Another worker stored the same body first.
+            if e.errno != errno.EEXIST:
+                raise
+
+
+def _collect_garbage(store_dir):
+    """ Removes the objects that no file links to anymore. """
+    for directory, dirnames, filenames in os.walk(store_dir):
+        for filename in filenames:
+            object_path = os.path.join(directory, filename)
+            if os.stat(object_path).st_nlink == 1:
+                os.remove(object_path)
+
+
+def _get_variants(mime, size):
+    if should_precompress(mime, size):
+        return COMPRESSED_VARIANTS
+    return []
+
 
 # Unfortunately split out from the class at the moment to allow rendering with
 # several processes via `multiprocessing`.
 # TODO: re-implement within the class if possible?
 def _disk_render_path(args):
-    client, path, view = args
+    client, path, view, previous, output_dir, previous_dir, store_dir = args
     if not client:
-        client = Client()
-    if path:
-        DEPLOY_DIR = settings.MEDUSA_DEPLOY_DIR
-        realpath = path
-        if path.startswith("/"):
-            realpath = realpath[1:]
-
-        if path.endswith("/"):
-            needs_ext = True
+        client = get_client()
+    if not path:
+        raise ValueError("Can't render an empty path; check get_paths().")
+
+    # When staging, write into the new generation and compare against
+    # (and reuse files from) the previous one.
+    DEPLOY_DIR = output_dir or settings.MEDUSA_DEPLOY_DIR
+    previous_dir = previous_dir or DEPLOY_DIR
+
+    # Let the view answer with a 304 if the previous run's file (and
+    # compressed variants) can be kept as they are.
+    headers = {}
+    if previous and os.path.exists(
+        os.path.join(previous_dir, previous["outpath"])
+    ) and previous.get("variants", []) == [
+        ext for ext, encoding, compress
+        in _get_variants(previous["mime"], previous["size"])
+    ]:
+        headers = get_conditional_headers(previous)
+
+    start = time.time()
+    resp = client.get(path, **headers)
+    if resp.status_code == 304 and headers:
+        previous_outpath = os.path.join(previous_dir, previous["outpath"])
+        outpath = os.path.join(DEPLOY_DIR, previous["outpath"])
+        if previous_outpath != outpath:
+            for ext in [""] + previous["variants"]:
+                _reuse_file(previous_outpath + ext, outpath + ext)
+        record(path, render=time.time() - start)
+        return path, "unchanged", previous
+    if resp.status_code != 200:
+        raise ResponseError(path, resp.status_code)
+    minify_response(path, resp)
+    return _disk_write_response(args, resp, start)
+
+
+def _disk_write_response(args, resp, start):
+    """
+    Writes the rendered (200) response to `path` for `_disk_render_path`,
+    given its `args`, and returns the result. `start` is when rendering
+    began. Also the `write_func` of `DiskStaticSiteRenderer`.
+    """
+    client, path, view, previous, output_dir, previous_dir, store_dir = args
+    DEPLOY_DIR = output_dir or settings.MEDUSA_DEPLOY_DIR
+    previous_dir = previous_dir or DEPLOY_DIR
+    realpath = path
+    if path.startswith("/"):
+        realpath = realpath[1:]
+
+    if path.endswith("/"):
+        needs_ext = True
+    else:
+        needs_ext = False
+
+    outpath = os.path.join(DEPLOY_DIR, realpath)
+
+    mime = resp['Content-Type']
+    mime = mime.split(';', 1)[0]
+    if needs_ext:
+        # Check our override list above first.
+        ext = COMMON_MIME_MAPS.get(
+            mime,
+            mimetypes.guess_extension(mime)
+        )
+        if ext:
+            outpath += "index" + ext
         else:
-            needs_ext = False
+            # Default to ".html"
+            outpath += "index.html"
 
-        output_dir = os.path.abspath(os.path.join(
-            DEPLOY_DIR,
-            os.path.dirname(realpath)
-        ))
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        outpath = os.path.join(DEPLOY_DIR, realpath)
-
-        resp = client.get(path)
-        if resp.status_code != 200:
-            raise Exception
-        if needs_ext:
-            mime = resp['Content-Type']
-            mime = mime.split(';', 1)[0]
-
-            # Check our override list above first.
-            ext = COMMON_MIME_MAPS.get(
-                mime,
-                mimetypes.guess_extension(mime)
-            )
-            if ext:
-                outpath += "index" + ext
-            else:
-                # Default to ".html"
-                outpath += "index.html"
+    if resp.streaming:
+        # Write the body out as the view produces it, rather than holding
+        # all of it in memory; it replaces `outpath` once complete.
+        content = None
+        temp_path, digest, size = _write_stream(outpath,
+                                                iter_content(resp))
+    else:
+        content = resp.content
+        digest = hashlib.sha1(content).hexdigest()
+        size = len(content)
+    rendered = time.time()
+
+    variants = _get_variants(mime, size)
+    entry = {
+        "outpath": os.path.relpath(outpath, DEPLOY_DIR),
+        "hash": digest,
+        "size": size,
+        "mime": mime,
+        "variants": [ext for ext, encoding, compress in variants],
+    }
+    entry.update(get_validators(resp))
+
+    # Leave the file (and its mtime) alone if the previous run already
+    # wrote these exact bytes (and compressed variants) to the same place;
+    # when staging, hardlink it into the new generation instead.
+    previous_outpath = os.path.join(previous_dir, entry["outpath"])
+    status = None
+    if previous and previous.get("hash") == entry["hash"]\
+    and previous.get("outpath") == entry["outpath"]\
+    and previous.get("variants", []) == entry["variants"]\
+    and os.path.exists(previous_outpath)\
+    and os.path.getsize(previous_outpath) == entry["size"]:
+        status = "unchanged"
+        if previous_outpath != outpath:
+            try:
+                for ext in [""] + entry["variants"]:
+                    _link_file(previous_outpath + ext, outpath + ext)
+            except OSError:
+                # E.g. the generations are on different filesystems.
+                # Don't write through a link into the previous one.
+                status = None
+                for ext in [""] + entry["variants"]:
+                    if os.path.lexists(outpath + ext):
+                        os.remove(outpath + ext)
+
+    if status == "unchanged" and store_dir:
+        # Let later pages with the same bytes share this file.
+        _store_object(store_dir, entry, outpath)
+
+    if status is None:
+        status = "updated" if previous else "created"
         print(outpath)
-        with open(outpath, 'wb') as f:
-            f.write(resp.content)
+        if previous or store_dir:
+            # Replace rather than write into the old file, which may be
+            # hardlinked to other pages through the content store.
+            for ext in [""] + entry["variants"]:
+                if os.path.lexists(outpath + ext):
+                    os.remove(outpath + ext)
+        linked = store_dir and _link_object(store_dir, entry, outpath)
+        if linked:
+            # Another page has the same bytes: share its file.
+            pass
+        elif content is None:
+            os.rename(temp_path, outpath)
+            for ext, encoding, compress in variants:
+                _compress_file(outpath, outpath + ext, encoding)
+        else:
+            _write_file(outpath, content)
+            for ext, encoding, compress in variants:
+                _write_file(outpath + ext, compress(content))
+        if store_dir and not linked:
+            _store_object(store_dir, entry, outpath)
+        if previous:
+            for ext in previous.get("variants", []):
+                if ext not in entry["variants"]\
+                and os.path.exists(outpath + ext):
+                    os.remove(outpath + ext)
+
+    if content is None and os.path.exists(temp_path):
+        # Not needed after all.
+        os.remove(temp_path)
+    record(path, render=rendered - start, write=time.time() - rendered,
+           bytes=size)
+    return path, status, entry
 
 
 class DiskStaticSiteRenderer(BaseStaticSiteRenderer):
+    """
+    Writes the rendered paths into static files under MEDUSA_DEPLOY_DIR.
 
-    def render_path(self, path=None, view=None):
-        _disk_render_path((self.client, path, view))
-
-    def generate(self):
-        if getattr(settings, "MEDUSA_MULTITHREAD", False):
-            # Upload up to ten items at once via `multiprocessing`.
-            from multiprocessing import Pool, cpu_count
-
-            print("Generating with up to %d processes..." % cpu_count())
-            pool = Pool(cpu_count())
-
-            pool.map_async(
-                _disk_render_path,
-                ((None, path, None) for path in self.paths),
-                chunksize=5
-            )
-            pool.close()
-            pool.join()
+    Keeps a manifest of every written file (path -> content hash, size and
+    mimetype) in MEDUSA_DEPLOY_DIR, so that files whose contents did not
+    change since the previous run are not rewritten.
+
+    Streaming responses are written out (and hashed) as the view produces
+    them, into a temporary file that replaces the old one once complete.
+
+    Settings:
+      * MEDUSA_DEPLOY_DIR
+      * MEDUSA_INCREMENTAL (default: True) -- skip writing unchanged files.
+      * MEDUSA_PRUNE (default: False) -- delete files written by a previous
+        run that no renderer returned from `get_paths` this time.
+      * MEDUSA_PRECOMPRESS (default: False) -- also write `.gz` (and, if
+        `brotli` is installed, `.br`) files next to compressible files, for
+        e.g. nginx's `gzip_static`.
+      * MEDUSA_CONDITIONAL (default: True) -- store each path's ETag and
+        Last-Modified headers in the manifest and request it conditionally
+        on the next run; a 304 leaves the file as it is.
+      * MEDUSA_DISK_STAGED (default: False) -- render into a new sibling
+        directory ("generation") and, once everything is written, atomically
+        point MEDUSA_DEPLOY_DIR (a symlink) at it. Unchanged files are
+        hardlinked from the previous generation.
+      * MEDUSA_DISK_KEEP_GENERATIONS (default: 2) -- number of staged
+        generations (including the live one) to keep around.
+      * MEDUSA_DEDUPE (default: False) -- keep every distinct body once, in
+        a content store of files named by their hash, and hardlink the
+        files of all pages with that body to it.
+      * MEDUSA_DISK_CONTENT_STORE (default: MEDUSA_DEPLOY_DIR + ".objects")
+        -- must be on the same filesystem as MEDUSA_DEPLOY_DIR. Objects no
+        page uses anymore are removed at the end of full runs (not of
+        `staticsitewatch` batches).
+    """
+    @classmethod
+    def initialize_output(cls):
+        super(DiskStaticSiteRenderer, cls).initialize_output()
+        if getattr(settings, "MEDUSA_INCREMENTAL", True):
+            cls.previous_manifest = _load_manifest()
         else:
-            # Use standard, serial upload.
-            self.client = Client()
-            for path in self.paths:
-                self.render_path(path=path)
+            cls.previous_manifest = {}
+        cls.manifest = {}
+        cls.counts = {"created": 0, "updated": 0, "unchanged": 0}
+        cls.store_dir = _get_store_dir()
+
+        cls.output_dir = cls.previous_dir = None
+        if getattr(settings, "MEDUSA_DISK_STAGED", False):
+            if cls.shard_count > 1:
+                raise ImproperlyConfigured(
+                    "MEDUSA_DISK_STAGED can't be combined with sharding."
+                )
+            if cls.partial\
+            and not getattr(settings, "MEDUSA_INCREMENTAL", True):
+                raise ImproperlyConfigured(
+                    "MEDUSA_DISK_STAGED needs MEDUSA_INCREMENTAL to "
+                    "republish only some paths."
+                )
+            deploy_dir = settings.MEDUSA_DEPLOY_DIR.rstrip(os.sep)
+            if os.path.exists(deploy_dir):
+                cls.previous_dir = os.path.realpath(deploy_dir)
+            generations = _get_generations(deploy_dir)
+            if cls.resuming and generations\
+            and generations[-1] != cls.previous_dir:
+                # Pick up the generation the interrupted attempt was staging.
+                cls.output_dir = generations[-1]
+            else:
+                cls.output_dir = "%s%s%s" % (
+                    deploy_dir,
+                    GENERATION_SUFFIX,
+                    datetime.now().strftime("%Y%m%d%H%M%S%f")
+                )
+                os.makedirs(cls.output_dir)
+            print("Staging into %s" % cls.output_dir)
+
+    @classmethod
+    def finalize_output(cls):
+        print("%(created)d created, %(updated)d updated, "
+              "%(unchanged)d unchanged." % cls.counts)
+
+        if cls.output_dir:
+            # Files that were not rendered this time simply aren't part of
+            # the new generation, so there is nothing to prune. Unless only
+            # some paths were rendered, in which case everything else is
+            # brought over from the previous generation.
+            if cls.partial:
+                for path, entry in cls.previous_manifest.items():
+                    if path not in cls.manifest:
+                        cls.carry_over(entry)
+                        cls.manifest[path] = entry
+            if getattr(settings, "MEDUSA_INCREMENTAL", True):
+                _save_manifest(cls.manifest, cls.output_dir)
+            cls.publish()
+        elif getattr(settings, "MEDUSA_INCREMENTAL", True):
+            if getattr(settings, "MEDUSA_PRUNE", False) and not cls.partial:
+                cls.prune()
+            else:
+                # Keep tracking stale files so that a later run can prune
+                # them.
+                for path, entry in cls.previous_manifest.items():
+                    cls.manifest.setdefault(path, entry)
+            _save_manifest(cls.manifest)
+
+        if cls.store_dir and os.path.exists(cls.store_dir)\
+        and not cls.partial:
+            # Walks the whole store, which would make each small batch of
+            # `staticsitewatch` cost as much as the whole site. Objects left
+            # unused by those batches go with the next full run.
+            _collect_garbage(cls.store_dir)
+
+        super(DiskStaticSiteRenderer, cls).finalize_output()
+
+    @classmethod
+    def finalize_shard(cls):
+        print("%(created)d created, %(updated)d updated, "
+              "%(unchanged)d unchanged." % cls.counts)
+        state = super(DiskStaticSiteRenderer, cls).finalize_shard()
+        state.update(manifest=cls.manifest, counts=cls.counts)
+        return state
+
+    @classmethod
+    def merge_shard(cls, state):
+        super(DiskStaticSiteRenderer, cls).merge_shard(state)
+        cls.manifest.update(state["manifest"])
+        for status, count in state["counts"].items():
+            cls.counts[status] += count
+
+    @classmethod
+    def publish(cls):
+        """
+        Swaps the staged generation in by atomically replacing the
+        MEDUSA_DEPLOY_DIR symlink, then removes old generations.
+        """
+        deploy_dir = settings.MEDUSA_DEPLOY_DIR.rstrip(os.sep)
+        if os.path.isdir(deploy_dir) and not os.path.islink(deploy_dir):
+            # The first staged run over a plain directory can't be atomic:
+            # move the directory aside as the oldest generation.
+            os.rename(deploy_dir, deploy_dir + GENERATION_SUFFIX + "0")
+
+        temp_link = deploy_dir + ".tmp-link"
+        if os.path.lexists(temp_link):
+            os.remove(temp_link)
+        os.symlink(os.path.basename(cls.output_dir), temp_link)
+        os.rename(temp_link, deploy_dir)
+        print("Published %s" % cls.output_dir)
+
+        keep = max(getattr(settings, "MEDUSA_DISK_KEEP_GENERATIONS", 2), 1)
+        for generation in _get_generations(deploy_dir)[:-keep]:
+            if generation != os.path.abspath(cls.output_dir):
+                shutil.rmtree(generation)
+
+    @classmethod
+    def prune(cls):
+        """
+        Removes files that a previous run wrote but that were not generated
+        by this run, along with any directories left empty by that.
+        """
+        DEPLOY_DIR = os.path.abspath(settings.MEDUSA_DEPLOY_DIR)
+        current = set(entry["outpath"] for entry in cls.manifest.values())
+        for path, entry in cls.previous_manifest.items():
+            if path in cls.manifest or entry["outpath"] in current:
+                continue
+            outpath = os.path.join(DEPLOY_DIR, entry["outpath"])
+            if not os.path.exists(outpath):
+                continue
+            print("Pruning %s" % outpath)
+            os.remove(outpath)
+            for ext in entry.get("variants", []):
+                if os.path.exists(outpath + ext):
+                    os.remove(outpath + ext)
+
+            output_dir = os.path.dirname(outpath)
+            while output_dir != DEPLOY_DIR and not os.listdir(output_dir):
+                os.rmdir(output_dir)
+                output_dir = os.path.dirname(output_dir)
+
+    render_func = staticmethod(_disk_render_path)
+    write_func = staticmethod(_disk_write_response)
+
+    def get_render_args(self, path):
+        return (None, path, None, self.previous_manifest.get(path),
+                self.output_dir, self.previous_dir, self.store_dir)
+
+    def setup(self):
+        # Create the directory tree once, rather than checking for it in the
+        # workers for every path. A streaming `get_paths` is only walked once,
+        # so there the workers create directories as they need them.
+        if self.is_streaming():
+            return
+        deploy_dir = self.output_dir or settings.MEDUSA_DEPLOY_DIR
+        directories = set(os.path.dirname(path.lstrip("/"))
+                          for path in self.iter_paths())
+        for directory in sorted(directories):
+            _makedirs(os.path.join(deploy_dir, directory))
+
+    def collect_result(self, result):
+        path, status, entry = result
+        cls = type(self)
+        cls.manifest[path] = entry
+        cls.counts[status] += 1
+        if not self.as_sink:
+            report.add_body(entry["hash"], entry["size"])
+
+    @classmethod
+    def carry_over(cls, entry):
+        """
+        When staging, brings the file of a manifest `entry` (and its
+        variants) over from the previous generation, if it isn't there yet.
+        """
+        if not (cls.output_dir and cls.previous_dir):
+            return
+        source = os.path.join(cls.previous_dir, entry["outpath"])
+        outpath = os.path.join(cls.output_dir, entry["outpath"])
+        for ext in [""] + entry.get("variants", []):
+            if os.path.exists(source + ext)\
+            and not os.path.lexists(outpath + ext):
+                _reuse_file(source + ext, outpath + ext)
+
+    def collect_journaled(self, result):
+        # The interrupted attempt may have been published already, in which
+        # case its files are in what is now the previous generation.
+        self.carry_over(result[2])
+        self.collect_result(result)
+
+    def collect_failure(self, path, error):
+        # Keep whatever a previous run wrote for this path, rather than
+        # pruning it (or leaving it out of the new generation).
+        previous = self.previous_manifest.get(path)
+        if previous is None:
+            return
+        type(self).manifest[path] = previous
+        self.carry_over(previous)
+
+    def render_path(self, path=None, view=None):
+        return _disk_render_path((
+            self.client, path, view, self.previous_manifest.get(path),
+            self.output_dir, self.previous_dir, self.store_dir
+        ))
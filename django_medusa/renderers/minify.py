@@ -0,0 +1,107 @@
+"""
+Minification of rendered bodies, between rendering a path and writing (or
+uploading) it, in whichever process renders it.
+
+With MEDUSA_MINIFY = True, each response is run through the chain of
+minifiers configured for its mimetype in MEDUSA_MINIFIERS: a dict whose keys
+are either mimetypes ("text/css") or file extensions (".css", matched via
+`COMMON_MIME_MAPS` the way renderers name their files), and whose values are
+lists of functions (or their dotted names) that take the body as bytes and
+return it minified. The renderers then hash, compress and compare the
+minified body, so unchanged pages are still skipped.
+
+Streamed responses are written as they are.
+"""
+from django.conf import settings
+from importlib import import_module
+import mimetypes
+import re
+import time
+from ..report import record
+from .base import COMMON_MIME_MAPS
+
+__all__ = ('DEFAULT_MINIFIERS', 'get_minifiers', 'minify_html',
+           'minify_json', 'minify_response')
+
+DEFAULT_MINIFIERS = {
+    ".html": ["django_medusa.renderers.minify.minify_html"],
+    ".json": ["django_medusa.renderers.minify.minify_json"],
+}
+
+# Parts of an HTML document whose whitespace is kept as it is: the contents
+# of elements where it matters, comments (e.g. conditional ones) and tags
+# (attribute values).
+_HTML_PRESERVED = re.compile(
+    br'<(pre|textarea|script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>',
+    re.IGNORECASE | re.DOTALL
+)
+_HTML_WHITESPACE = re.compile(br'\s+')
+_JSON_TOKENS = re.compile(br'("(?:[^"\\]|\\.)*")|\s+')
+
+# Mimetype -> the minifiers to run, as resolved from the settings.
+_chains = {}
+
+
+def _collapse(match):
+    return b"\n" if b"\n" in match.group() else b" "
+
+
+def minify_html(content):
+    """
+    Collapses each run of whitespace between tags into a single space (or
+    newline), which browsers render the same way.
+    """
+    parts = []
+    last = 0
+    for match in _HTML_PRESERVED.finditer(content):
+        text = content[last:match.start()]
+        parts.append(_HTML_WHITESPACE.sub(_collapse, text))
+        parts.append(match.group())
+        last = match.end()
+    parts.append(_HTML_WHITESPACE.sub(_collapse, content[last:]))
+    return b"".join(parts)
+
+
+def minify_json(content):
+    """ Removes all whitespace outside of strings. """
+    return _JSON_TOKENS.sub(lambda match: match.group(1) or b"", content)
+
+
+def _get_function(name):
+    if callable(name):
+        return name
+    mod_path, func_name = name.rsplit('.', 1)
+    return getattr(import_module(mod_path), func_name)
+
+
+def get_minifiers(mimetype):
+    """ Returns the functions to run over a body of `mimetype`, in order. """
+    if mimetype not in _chains:
+        config = {}
+        if getattr(settings, "MEDUSA_MINIFY", False):
+            config = getattr(settings, "MEDUSA_MINIFIERS", DEFAULT_MINIFIERS)
+        ext = COMMON_MIME_MAPS.get(mimetype,
+                                   mimetypes.guess_extension(mimetype))
+        names = config.get(mimetype, config.get(ext, ()))
+        _chains[mimetype] = [_get_function(name) for name in names]
+    return _chains[mimetype]
+
+
+def minify_response(path, response):
+    """
+    Replaces the body of the rendered `response` for `path` with its
+    minified version, if there are minifiers for its mimetype.
+    """
+    if response.streaming:
+        return
+    mimetype = response['Content-Type'].split(";", 1)[0]
+    minifiers = get_minifiers(mimetype)
+    if not minifiers:
+        return
+    start = time.time()
+    content = original = response.content
+    for minifier in minifiers:
+        content = minifier(content)
+    response.content = content
+    record(path, minify=time.time() - start,
+           minified=(mimetype, len(original), len(content)))
@@ -1,47 +1,232 @@
 from __future__ import print_function
-try:
-    import cStringIO
-except ImportError:  # >=Python 3.
-    from io import StringIO as cStringIO
 from datetime import timedelta, datetime
+from io import BytesIO
+import base64
+import hashlib
+import json
+import threading
+import time
+import traceback
+try:
+    import queue
+except ImportError:  # <Python 3.
+    import Queue as queue
 from django.conf import settings
-from django.test.client import Client
-from .base import BaseStaticSiteRenderer
+from ..client import ResponseError, get_client
+from ..journal import journal
+from ..report import record, report
+from ..scheduler import call_with_retries
+from .base import BaseStaticSiteRenderer, SpooledBody, \
+    get_conditional_headers, get_validators, gzip_compress, iter_content, \
+    should_precompress, spool
+from .minify import minify_response
 
 __all__ = ('S3StaticSiteRenderer', )
 
 
 def _get_cf():
     from boto.cloudfront import CloudFrontConnection
-    return CloudFrontConnection(
+    kwargs = {}
+    # Point the renderer at a CloudFront API stand-in (e.g. a local stub).
+    host = getattr(settings, "MEDUSA_AWS_CLOUDFRONT_HOST", None)
+    if host:
+        kwargs.update(
+            host=host,
+            port=getattr(settings, "MEDUSA_AWS_CLOUDFRONT_PORT", None)
+        )
+    conn = CloudFrontConnection(
         aws_access_key_id=settings.AWS_ACCESS_KEY,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        **kwargs
     )
+    if host and not getattr(settings, "MEDUSA_AWS_CLOUDFRONT_SECURE", True):
+        # CloudFrontConnection always asks for HTTPS.
+        conn.is_secure = False
+        conn.protocol = "http"
+    return conn
 
 
-def _get_distribution():
-    if not getattr(settings, "AWS_DISTRIBUTION_ID", None):
-        return None
+def _get_distribution(cf):
+    return cf.get_distribution_info(settings.AWS_DISTRIBUTION_ID)
 
-    conn = _get_cf()
-    try:
-        return conn.get_distribution_info(settings.AWS_DISTRIBUTION_ID)
-    except:
-        return None
 
+def _parent_path(path):
+    """ "/blog/2012/post/" and "/blog/2012/*" -> "/blog/" """
+    return path.rstrip("*").rstrip("/").rsplit("/", 1)[0] + "/"
 
-def _get_bucket():
-    from boto.s3.connection import S3Connection
-    conn = S3Connection(
+
+def _collapse_paths(paths, threshold):
+    """
+    Replaces every group of at least `threshold` paths that share a parent
+    directory with a single "/parent/*" wildcard, repeating up the tree
+    until no group is large enough, and drops paths a wildcard covers.
+
+    Never collapses into "/*": invalidating the whole distribution has to be
+    asked for explicitly.
+    """
+    paths = set(paths)
+    threshold = max(threshold, 2)
+    while True:
+        siblings = {}
+        for path in paths:
+            siblings.setdefault(_parent_path(path), []).append(path)
+        collapsible = [
+            parent for parent, children in siblings.items()
+            if len(children) >= threshold and parent != "/"
+        ]
+        if not collapsible:
+            return sorted(paths)
+        for parent in collapsible:
+            paths.difference_update(siblings[parent])
+            paths.add(parent + "*")
+
+        prefixes = tuple(p[:-1] for p in paths if p.endswith("*"))
+        paths = set(
+            p for p in paths
+            if p.endswith("*") or not p.startswith(prefixes)
+        )
+
+
+def _is_wildcard(path):
+    return path.endswith("*")
+
+
+def _get_batches(paths, batch_size, max_wildcards):
+    """
+    Splits `paths` into batches of at most `batch_size` paths, of which at
+    most `max_wildcards` are wildcards. Wildcards go first, with the plain
+    paths filling up the rest of each batch.
+    """
+    wildcards = [path for path in paths if _is_wildcard(path)]
+    plain = [path for path in paths if not _is_wildcard(path)]
+    max_wildcards = min(max_wildcards, batch_size)
+    batches = []
+    while wildcards or plain:
+        batch = wildcards[:max_wildcards]
+        del wildcards[:max_wildcards]
+        room = batch_size - len(batch)
+        batch.extend(plain[:room])
+        del plain[:room]
+        batches.append(batch)
+    return batches
+
+
+def _invalidate(paths):
+    """
+    Invalidates `paths` on the AWS_DISTRIBUTION_ID CloudFront distribution,
+    in batches of at most MEDUSA_INVALIDATION_BATCH_SIZE paths.
+
+    CloudFront refuses new invalidations while too many are in progress, so
+    instead of dropping them this waits for a free slot whenever
+    MEDUSA_INVALIDATION_MAX_IN_PROGRESS batches are already running, or
+    whenever a batch would take the wildcard paths of our batches still in
+    progress over MEDUSA_INVALIDATION_MAX_WILDCARDS.
+    """
+    batch_size = getattr(settings, "MEDUSA_INVALIDATION_BATCH_SIZE", 1000)
+    max_in_progress = getattr(
+        settings, "MEDUSA_INVALIDATION_MAX_IN_PROGRESS", 3
+    )
+    max_wildcards = getattr(settings, "MEDUSA_INVALIDATION_MAX_WILDCARDS", 15)
+    poll_interval = getattr(settings, "MEDUSA_INVALIDATION_POLL_INTERVAL", 30)
+
+    cf = _get_cf()
+    # Request ID -> number of wildcards, for our batches still in progress.
+    pending = {}
+
+    def pending_wildcards():
+        for request_id in list(pending):
+            status = cf.invalidation_request_status(
+                settings.AWS_DISTRIBUTION_ID,
+                request_id
+            ).status
+            if status != "InProgress":
+                del pending[request_id]
+        return sum(pending.values())
+
+    for batch in _get_batches(paths, batch_size, max_wildcards):
+        wildcards = len([path for path in batch if _is_wildcard(path)])
+        while _get_distribution(cf).in_progress_invalidation_batches\
+        >= max_in_progress\
+        or (wildcards and pending_wildcards() + wildcards > max_wildcards):
+            print("Waiting for in-progress invalidations to finish...")
+            time.sleep(poll_interval)
+        req = cf.create_invalidation_request(
+            settings.AWS_DISTRIBUTION_ID,
+            batch
+        )
+        if wildcards:
+            pending[req.id] = wildcards
+        print("Invalidating %d paths, %d of them wildcards (%s)." % (
+            len(batch), wildcards, req.id
+        ))
+
+
+def _get_connection():
+    from boto.s3.connection import S3Connection, OrdinaryCallingFormat
+    kwargs = {}
+    # Point the renderer at an S3-compatible stand-in (e.g. a local test
+    # server) instead of Amazon.
+    host = getattr(settings, "MEDUSA_AWS_S3_HOST", None)
+    if host:
+        kwargs.update(
+            host=host,
+            port=getattr(settings, "MEDUSA_AWS_S3_PORT", None),
+            is_secure=getattr(settings, "MEDUSA_AWS_S3_SECURE", True),
+            calling_format=OrdinaryCallingFormat()
+        )
+    return S3Connection(
         aws_access_key_id=settings.AWS_ACCESS_KEY,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        **kwargs
     )
-    bucket = (settings.MEDUSA_AWS_STORAGE_BUCKET_NAME if settings.MEDUSA_AWS_STORAGE_BUCKET_NAME else settings.AWS_STORAGE_BUCKET_NAME)
-    return conn.get_bucket(bucket)
 
 
-def _upload_to_s3(key, file):
-    key.set_contents_from_file(file, policy="public-read")
+def _get_bucket_name():
+    return getattr(settings, "MEDUSA_AWS_STORAGE_BUCKET_NAME", None)\
+        or settings.AWS_STORAGE_BUCKET_NAME
+
+
+# Each upload thread keeps one connection for its lifetime (boto connections
+# must not be shared between threads).
+_local = threading.local()
+
+
+def _get_bucket():
+    if getattr(_local, "bucket", None) is None:
+        # The main process already checked that the bucket exists.
+        _local.bucket = _get_connection().get_bucket(
+            _get_bucket_name(), validate=False
+        )
+    return _local.bucket
+
+
+def _get_etag_index(bucket):
+    """
+    Lists the whole bucket (in pages of 1000 keys) and returns a dict
+    mapping each key name (without leading slash) to its (unquoted) ETag.
+    """
+    return dict(
+        (key.name.lstrip("/"), key.etag.strip('"').strip("'"))
+        for key in bucket.list()
+    )
+
+
+# Private key that keeps the validators (ETag, Last-Modified) of each page's
+# response between runs, for conditional requests.
+VALIDATORS_KEY = ".medusa-validators.json"
+
+
+def _get_outpath(path):
+    # Default to "index.html" as the upload path if we're in a dir listing.
+    if path.endswith("/"):
+        return path + "index.html"
+    return path
+
+
+def _upload_to_s3(key, file, headers=None, md5=None):
+    key.set_contents_from_file(
+        file, headers=headers, policy="public-read", md5=md5
+    )
 
     cache_time = 0
     now = datetime.now()
@@ -51,58 +236,273 @@ def _upload_to_s3(key, file):
             'max-age=%d, must-revalidate' % int(cache_time))
         key.set_metadata('Expires',
             expire_dt.strftime("%a, %d %b %Y %H:%M:%S GMT"))
-    key.make_public()
+
+
+def _get_multipart_settings():
+    """
+    Returns the size above which bodies are uploaded in parts, and the size
+    of those parts (at least 5 MB, except for the last one).
+    """
+    return (
+        getattr(settings, "MEDUSA_MULTIPART_THRESHOLD", 8 * 1024 * 1024),
+        getattr(settings, "MEDUSA_MULTIPART_PART_SIZE", 8 * 1024 * 1024),
+    )
+
+
+class _Digest(object):
+    """
+    Hashes a body as it is produced: its MD5, and the MD5 of the MD5s of its
+    parts, which is the ETag S3 gives it when it is uploaded in parts.
+    """
+    def __init__(self):
+        self.threshold, self.part_size = _get_multipart_settings()
+        self.md5 = hashlib.md5()
+        self.size = 0
+        self.parts = []
+        self.part = hashlib.md5()
+        self.part_bytes = 0
+
+    def update(self, data):
+        self.md5.update(data)
+        self.size += len(data)
+        start = 0
+        while start < len(data):
+            piece = data[start:start + self.part_size - self.part_bytes]
+            self.part.update(piece)
+            self.part_bytes += len(piece)
+            start += len(piece)
+            if self.part_bytes == self.part_size:
+                self.parts.append(self.part.digest())
+                self.part = hashlib.md5()
+                self.part_bytes = 0
+
+    def get_etags(self):
+        """ Returns the ETags that mean the bucket has this body already. """
+        etags = [self.md5.hexdigest()]
+        if self.size > self.threshold:
+            parts = self.parts + ([self.part.digest()]
+                                  if self.part_bytes else [])
+            etags.append("%s-%d" % (
+                hashlib.md5(b"".join(parts)).hexdigest(), len(parts)
+            ))
+        return etags
 
 
 # Unfortunately split out from the class at the moment to allow rendering with
 # several processes via `multiprocessing`.
 # TODO: re-implement within the class if possible?
 def _s3_render_path(args):
-    client, bucket, path, view = args
+    """
+    Renders `path` and returns what the upload stage needs to know about it.
+    The body is only included if it differs from what is in the bucket.
+    """
+    client, path, view, etag, validators = args
     if not client:
-        client = Client()
+        client = get_client()
+    outpath = _get_outpath(path)
+
+    # Render the view, conditionally if the page is still in the bucket.
+    headers = get_conditional_headers(validators) if etag else {}
+    start = time.time()
+    resp = client.get(path, **headers)
+    if resp.status_code == 304 and headers:
+        record(path, render=time.time() - start)
+        return path, outpath, "Skipping", None, None, None, validators
+    if resp.status_code != 200:
+        raise ResponseError(path, resp.status_code)
+    minify_response(path, resp)
+    return _s3_write_response(args, resp, start)
 
-    if not bucket:
-        bucket = _get_bucket()
 
-    # Render the view
-    resp = client.get(path)
-    if resp.status_code != 200:
-        raise Exception
+def _s3_write_response(args, resp, start):
+    """
+    Prepares the rendered (200) response of `path` for upload, given the
+    `args` of `_s3_render_path`. `start` is when rendering began. Also the
+    `write_func` of `S3StaticSiteRenderer`.
+    """
+    client, path, view, etag, validators = args
+    outpath = _get_outpath(path)
+    headers = {'Content-Type': resp['Content-Type']}
+
+    # Deterministic gzip output keeps the ETag of unchanged pages stable.
+    mime = resp['Content-Type'].split(";", 1)[0]
+    if resp.streaming:
+        size = resp['Content-Length'] if resp.has_header('Content-Length')\
+            else None
+        compress = should_precompress(mime, size and int(size))
+        digest = _Digest()
+        content = spool(iter_content(resp), digest,
+                        "gzip" if compress else None)
+    else:
+        content = resp.content
+        compress = should_precompress(mime, len(content))
+        if compress:
+            content = gzip_compress(content)
+        digest = _Digest()
+        digest.update(content)
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    record(path, render=time.time() - start, bytes=digest.size)
+
+    # `etag` comes from the bucket listing made before rendering started, so
+    # unchanged pages need no round trip to S3 at all.
+    validators = get_validators(resp)
+    if etag and etag in digest.get_etags():
+        if isinstance(content, SpooledBody):
+            content.remove()
+        return path, outpath, "Skipping", None, None, None, validators
+
+    md5 = (
+        digest.md5.hexdigest(),
+        base64.b64encode(digest.md5.digest()).decode('ascii')
+    )
+    message = "Updating" if etag else "Creating"
+    return path, outpath, message, headers, content, md5, validators
+
+
+def _load_validators(bucket, etags=None):
+    if etags is not None and VALIDATORS_KEY not in etags:
+        return {}
+    key = bucket.get_key(VALIDATORS_KEY)
+    if key is None:
+        return {}
+    try:
+        return json.loads(key.get_contents_as_string().decode("utf-8"))
+    except ValueError:
+        return {}
 
-    # Default to "index.html" as the upload path if we're in a dir listing.
-    outpath = path
-    if path.endswith("/"):
-        outpath += "index.html"
 
-    key = bucket.get_key(outpath) or bucket.new_key(outpath)
-    key.content_type = resp['Content-Type']
+def _save_validators(validators):
+    key = _get_bucket().new_key(VALIDATORS_KEY)
+    key.set_contents_from_string(
+        json.dumps(validators, separators=(',', ':'), sort_keys=True),
+        headers={'Content-Type': 'application/json'},
+        policy="private"
+    )
+
+
+def _upload_multipart(bucket, outpath, file, size, headers=None):
+    part_size = _get_multipart_settings()[1]
+    upload = bucket.initiate_multipart_upload(
+        outpath, headers=headers, policy="public-read"
+    )
+    try:
+        for number, offset in enumerate(range(0, size, part_size), 1):
+            file.seek(offset)
+            upload.upload_part_from_file(
+                file, number, size=min(part_size, size - offset)
+            )
+        upload.complete_upload()
+    except Exception:
+        upload.cancel_upload()
+        raise
 
-    temp_file = cStringIO.StringIO(resp.content)
-    md5 = key.compute_md5(temp_file)
 
-    # If key is new, there's no etag yet
-    if not key.etag:
-        _upload_to_s3(key, temp_file)
-        message = "Creating"
+def _copy_key(source, outpath, headers):
+    bucket = _get_bucket()
+    headers = dict(headers, **{"x-amz-acl": "public-read"})
+    # Empty metadata replaces the source's headers with this page's.
+    bucket.copy_key(outpath, bucket.name, source, metadata={},
+                    headers=headers)
 
+
+def _s3_upload(job, source=None):
+    """
+    Uploads a rendered page, or copies it from the key `source` (which has
+    the same bytes) within the bucket, if given.
+    """
+    path, outpath, message, headers, content, md5, validators = job
+    if source is not None:
+        _copy_key(source, outpath, headers)
+        return
+    if isinstance(content, SpooledBody):
+        temp_file, size = content.open(), content.size
     else:
-        etag = key.etag or ''
-        # for some weird reason, etags are quoted, strip them
-        etag = etag.strip('"').strip("'")
-        if etag not in md5:
-            _upload_to_s3(key, temp_file)
-            message = "Updating"
+        temp_file, size = BytesIO(content), len(content)
+    try:
+        if size > _get_multipart_settings()[0]:
+            # Only one part at a time is read into memory.
+            _upload_multipart(_get_bucket(), outpath, temp_file, size,
+                              headers)
         else:
-            message = "Skipping"
+            key = _get_bucket().new_key(outpath)
+            _upload_to_s3(key, temp_file, headers, md5)
+    finally:
+        temp_file.close()
+
 
-    print("%s http://%s%s" % (
-        message,
-        bucket.get_website_endpoint(),
-        path
-    ))
-    temp_file.close()
-    return [path, outpath]
+class _Uploader(object):
+    """
+    The upload stage of the S3 pipeline: a pool of threads uploading
+    rendered pages from a bounded queue, so that rendering (in the worker
+    processes) and network I/O (here) overlap instead of blocking each other.
+    """
+    def __init__(self, threads, queue_size):
+        self.queue = queue.Queue(queue_size)
+        # MD5 -> name of each key uploaded (or copied) so far.
+        self.uploaded = {}
+        self.peak_depth = 0
+        self.total_depth = 0
+        self.puts = 0
+        self.threads = []
+        for _ in range(threads):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self._upload(*item)
+            except Exception:
+                # Even recording the failure failed. Keep going regardless:
+                # without this thread the queue fills up and `put` blocks
+                # the render stage for good.
+                traceback.print_exc()
+
+    def _upload(self, job, source):
+        start = time.time()
+        path, outpath, content, md5, validators = job[0], job[1], job[4], \
+            job[5], job[6]
+        try:
+            # Network errors and 5xx responses are retried.
+            call_with_retries(_s3_upload, job, source)
+            self.uploaded[md5[0]] = outpath.lstrip("/")
+            report.add(None, path, {"upload": time.time() - start})
+            # Only now is the page safe to skip when resuming.
+            journal.add(path, (
+                path, outpath, "Uploaded", None, None, None, validators
+            ))
+        except Exception:
+            report.add_failure(None, path, traceback.format_exc())
+        finally:
+            if isinstance(content, SpooledBody):
+                content.remove()
+
+    def put(self, job, source=None):
+        # Blocks while the queue is full, which in turn holds back the
+        # render stage.
+        depth = self.queue.qsize()
+        self.peak_depth = max(self.peak_depth, depth)
+        self.total_depth += depth
+        self.puts += 1
+        self.queue.put((job, source))
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+        print("Upload stage: %d threads, queue depth peak %d, average %.1f." % (
+            len(self.threads),
+            self.peak_depth,
+            float(self.total_depth) / max(self.puts, 1)
+        ))
 
 
 class S3StaticSiteRenderer(BaseStaticSiteRenderer):
@@ -116,58 +516,197 @@ class S3StaticSiteRenderer(BaseStaticSiteRenderer):
       * AWS_ACCESS_KEY
       * AWS_SECRET_ACCESS_KEY
       * AWS_STORAGE_BUCKET_NAME
+
+    The ETags of all keys in the bucket are listed once before rendering, so
+    that unchanged pages are skipped without contacting S3.
+
+    Rendering happens in the shared pool of worker processes (see
+    `django_medusa.tuner`), while a separate stage of MEDUSA_UPLOAD_THREADS
+    threads (default: 20) uploads the results, fed through a queue of at
+    most MEDUSA_UPLOAD_QUEUE_SIZE pages (default: 100).
+
+    With MEDUSA_CONDITIONAL (default: True), the ETag and Last-Modified
+    headers of each page are kept in a private `.medusa-validators.json` key
+    and the page is requested conditionally on the next run; a 304 skips it.
+
+    With MEDUSA_PRECOMPRESS, compressible pages are uploaded gzipped (with
+    `Content-Encoding: gzip`).
+
+    With MEDUSA_DEDUPE, a page whose body is identical to that of a key
+    uploaded (or found unchanged) earlier in the run is copied from that key
+    within the bucket instead of being uploaded again.
+
+    Streaming responses are spooled to a temporary file in MEDUSA_SPOOL_DIR
+    by the render worker instead of being held in memory. Bodies larger than
+    MEDUSA_MULTIPART_THRESHOLD (default: 8 MB) are uploaded in parts of
+    MEDUSA_MULTIPART_PART_SIZE (default: 8 MB).
+
+    With AWS_DISTRIBUTION_ID, the paths that were created or updated are
+    invalidated on CloudFront once all uploads are done:
+      * MEDUSA_INVALIDATION_WILDCARD_THRESHOLD (default: 10) -- replace
+        this many changed paths (or wildcards) in one directory other than
+        the root with "/dir/*", which then invalidates everything below it.
+      * MEDUSA_INVALIDATION_BATCH_SIZE (default: 1000)
+      * MEDUSA_INVALIDATION_MAX_IN_PROGRESS (default: 3) -- wait while this
+        many invalidation batches are in progress.
+      * MEDUSA_INVALIDATION_MAX_WILDCARDS (default: 15, CloudFront's limit)
+        -- wait while this many of our wildcard paths are in progress.
+      * MEDUSA_INVALIDATION_POLL_INTERVAL (default: 30 seconds)
+
+    To use an S3-compatible server other than Amazon (e.g. a local stand-in
+    for testing):
+      * MEDUSA_AWS_S3_HOST
+      * MEDUSA_AWS_S3_PORT
+      * MEDUSA_AWS_S3_SECURE (default: True)
+      * MEDUSA_AWS_CLOUDFRONT_HOST
+      * MEDUSA_AWS_CLOUDFRONT_PORT
+      * MEDUSA_AWS_CLOUDFRONT_SECURE (default: True)
     """
+    render_func = staticmethod(_s3_render_path)
+    write_func = staticmethod(_s3_write_response)
+
     @classmethod
     def initialize_output(cls):
-        cls.all_generated_paths = []
-
-    def render_path(self, path=None, view=None):
-        return _s3_render_path((self.client, self.bucket, path, view))
+        super(S3StaticSiteRenderer, cls).initialize_output()
+        cls.all_changed_paths = []
+        cls.validators = {}
+        # ETag -> name of each key found unchanged during this run.
+        cls.unchanged_keys = {}
+        if cls.merging:
+            # Nothing is rendered or uploaded while merging shards.
+            cls.etags, cls.previous_validators, cls.uploader = {}, {}, None
+            return
+
+        # One listing of the bucket and one upload stage per run, shared by
+        # all renderers.
+        bucket = _get_connection().get_bucket(_get_bucket_name())
+        cls.previous_validators = {}
+        if cls.partial:
+            # Rather than listing the whole bucket, `setup` looks up just
+            # the keys about to be rendered.
+            cls.etags = {}
+            if getattr(settings, "MEDUSA_CONDITIONAL", True):
+                cls.previous_validators = _load_validators(bucket)
+        else:
+            print("Indexing bucket %s..." % bucket.name)
+            cls.etags = _get_etag_index(bucket)
+            if getattr(settings, "MEDUSA_CONDITIONAL", True):
+                cls.previous_validators = _load_validators(bucket, cls.etags)
+        cls.uploader = _Uploader(
+            getattr(settings, "MEDUSA_UPLOAD_THREADS", 20),
+            getattr(settings, "MEDUSA_UPLOAD_QUEUE_SIZE", 100)
+        )
 
-    def generate(self):
-        from boto.s3.connection import S3Connection
+    def get_etag(self, path):
+        """ Returns the ETag the bucket had for `path` before this run. """
+        return self.etags.get(_get_outpath(path).lstrip("/"))
 
-        self.conn = S3Connection(
-            aws_access_key_id=settings.AWS_ACCESS_KEY,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
-        )
-        self.bucket = (self.conn.get_bucket(settings.MEDUSA_AWS_STORAGE_BUCKET_NAME) if settings.MEDUSA_AWS_STORAGE_BUCKET_NAME else self.conn.get_bucket(settings.AWS_STORAGE_BUCKET_NAME))
+    def render_path(self, path=None, view=None):
+        return _s3_render_path((
+            self.client, path, view, self.get_etag(path),
+            self.previous_validators.get(path)
+        ))
+
+    def get_render_args(self, path):
+        return (None, path, None, self.get_etag(path),
+                self.previous_validators.get(path))
+
+    def setup(self):
+        self.conn = _get_connection()
+        self.bucket = self.conn.get_bucket(_get_bucket_name())
         self.bucket.configure_website("index.html", "500.html")
         self.server_root_path = self.bucket.get_website_endpoint()
+        if self.partial:
+            for path in self.iter_paths():
+                name = _get_outpath(path).lstrip("/")
+                key = self.bucket.get_key(name)
+                if key is not None:
+                    self.etags[name] = key.etag.strip('"').strip("'")
+
+        self.changed_paths = []
+
+    def get_copy_source(self, md5, outpath):
+        """
+        Returns the name of a key known to have the body with the MD5 `md5`
+        (other than `outpath`), to copy within the bucket instead of
+        uploading it again, if MEDUSA_DEDUPE is set. Only keys that were
+        uploaded or found unchanged during this run count, as others might
+        still change.
+        """
+        if not getattr(settings, "MEDUSA_DEDUPE", False):
+            return None
+        source = self.unchanged_keys.get(md5)\
+            or self.uploader.uploaded.get(md5)
+        if source == outpath.lstrip("/"):
+            return None
+        return source
+
+    def collect_result(self, result):
+        path, outpath, message, headers, content, md5, validators = result
+        if content is not None:
+            source = self.get_copy_source(md5[0], outpath)
+            if source is not None:
+                message = "Copying %s to" % source
+            if not self.as_sink:
+                report.add_body(md5[0], content.size
+                                if isinstance(content, SpooledBody)
+                                else len(content))
+            self.uploader.put(result, source)
+        elif message == "Skipping" and self.get_etag(path):
+            if not self.as_sink:
+                report.add_body(self.get_etag(path))
+            self.unchanged_keys.setdefault(
+                self.get_etag(path), outpath.lstrip("/")
+            )
+        print("%s http://%s%s" % (message, self.server_root_path, path))
+        if message != "Skipping":
+            self.changed_paths.append(path)
+        if validators:
+            self.validators[path] = validators
 
-        self.generated_paths = []
-        if getattr(settings, "MEDUSA_MULTITHREAD", False):
-            # Upload up to ten items at once via `multiprocessing`.
-            from multiprocessing import Pool
-            import itertools
-
-            print("Uploading with up to 10 upload processes...")
-            pool = Pool(10)
+    def journal_result(self, path, result):
+        # Pages to upload are journaled by the upload stage once uploaded.
+        if result[4] is None:
+            super(S3StaticSiteRenderer, self).journal_result(path, result)
 
-            path_tuples = pool.map(
-                _s3_render_path,
-                ((None, None, path, None) for path in self.paths),
-                chunksize=5
-            )
-            pool.close()
-            pool.join()
+    def teardown(self):
+        type(self).all_changed_paths += self.changed_paths
 
-            self.generated_paths = list(itertools.chain(*path_tuples))
-        else:
-            # Use standard, serial upload.
-            self.client = Client()
-            for path in self.paths:
-                self.generated_paths += self.render_path(path=path)
+    @classmethod
+    def finalize_shard(cls):
+        cls.uploader.close()
+        state = super(S3StaticSiteRenderer, cls).finalize_shard()
+        state.update(changed_paths=cls.all_changed_paths,
+                     validators=cls.validators)
+        return state
 
-        type(self).all_generated_paths += self.generated_paths
+    @classmethod
+    def merge_shard(cls, state):
+        super(S3StaticSiteRenderer, cls).merge_shard(state)
+        cls.all_changed_paths += state["changed_paths"]
+        cls.validators.update(state["validators"])
 
     @classmethod
     def finalize_output(cls):
-        dist = _get_distribution()
-        if dist and dist.in_progress_invalidation_batches < 3:
-            cf = _get_cf()
-            req = cf.create_invalidation_request(
-                settings.AWS_DISTRIBUTION_ID,
-                cls.all_generated_paths
-            )
-            print(req.id)
+        # Wait for the upload stage to drain before invalidating anything.
+        if cls.uploader is not None:
+            cls.uploader.close()
+
+        if getattr(settings, "MEDUSA_CONDITIONAL", True):
+            if cls.partial:
+                # Keep the validators of the paths not rendered this time.
+                validators = dict(cls.previous_validators)
+                validators.update(cls.validators)
+                cls.validators = validators
+            # A page that failed to upload must not be skipped next time.
+            for failure in report.failures:
+                cls.validators.pop(failure["path"], None)
+            _save_validators(cls.validators)
+
+        if getattr(settings, "AWS_DISTRIBUTION_ID", None):
+            _invalidate(_collapse_paths(
+                cls.all_changed_paths,
+                getattr(settings, "MEDUSA_INVALIDATION_WILDCARD_THRESHOLD", 10)
+            ))
+
+        super(S3StaticSiteRenderer, cls).finalize_output()
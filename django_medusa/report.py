@@ -0,0 +1,259 @@
+"""
+Per-path timings for a `staticsitegen` run.
+
+Render functions call `record()` with the timings of each path (in whichever
+process they run in); the scheduler collects those and adds them to the
+run's `report` in the main process, which is written out as JSON by
+`BaseStaticSiteRenderer.finalize_output` when MEDUSA_REPORT_PATH is set.
+
+With MEDUSA_COST_HISTORY set, the time each path took to render is also kept
+in that (JSON) file from run to run, for the scheduler to hand out the most
+expensive paths first.
+"""
+from __future__ import print_function
+from datetime import datetime
+import heapq
+import json
+import os
+import threading
+import time
+import traceback
+from django.conf import settings
+from .signals import path_rendered, report_ready
+
+__all__ = ('Report', 'report', 'record', 'collect', 'load_costs')
+
+# Timings recorded in this process that have not been collected yet.
+_pending = []
+
+
+def _send(signal, **kwargs):
+    """
+    Sends `signal`, printing the errors of its receivers instead of raising
+    them: a metrics hook must not break (or fail paths of) a run.
+    """
+    for receiver, result in signal.send_robust(sender=Report, **kwargs):
+        if isinstance(result, Exception):
+            print("Signal receiver %r failed:\n%s" % (receiver, "".join(
+                traceback.format_exception(
+                    type(result), result,
+                    getattr(result, "__traceback__", None)
+                )
+            )))
+
+
+def record(path, **timings):
+    """
+    Records timings (in seconds, or `bytes`) for `path`, e.g.
+    `record("/about/", render=0.2, write=0.01, bytes=5120)`. `minified` is
+    the `(mimetype, size, minified size)` of a minified body.
+    """
+    _pending.append((path, timings))
+
+
+def collect():
+    """ Returns and forgets the timings recorded in this process so far. """
+    pending = _pending[:]
+    del _pending[:]
+    return pending
+
+
+def load_costs():
+    """
+    Returns the render time of each path as of the last run that rendered
+    it, from MEDUSA_COST_HISTORY (empty if that isn't set).
+    """
+    history_path = getattr(settings, "MEDUSA_COST_HISTORY", None)
+    if not history_path:
+        return {}
+    try:
+        with open(history_path, "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _save_costs(paths):
+    history_path = getattr(settings, "MEDUSA_COST_HISTORY", None)
+    if not history_path:
+        return
+    costs = load_costs()
+    for path, entry in paths.items():
+        # What a worker spends on the path; uploads happen elsewhere.
+        costs[path] = sum(entry.get(name, 0)
+                          for name in ("prefetch", "render", "minify",
+                                       "write"))
+    temp_path = history_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(costs, f, separators=(',', ':'))
+    os.rename(temp_path, history_path)
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Report(object):
+    """
+    Aggregates the timings of every path rendered during a run. Timings
+    for the same path are summed, so that e.g. the upload time measured in
+    the S3 upload stage is added to the render time measured in a worker.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.paths = {}
+        self.failures = []
+        # Time per path of each pool worker's first chunk.
+        self.first_chunks = []
+        # What the tuner settled on, when rendering with a pool.
+        self.tuning = {}
+        # Rendered bodies (by hash), to tell how many were identical.
+        self.digests = set()
+        self.dedupe = {"bodies": 0, "duplicates": 0, "bytes_saved": 0}
+        # Mimetype -> {"bodies", "bytes", "bytes_saved"} of minified bodies.
+        self.minified = {}
+        self.lock = threading.Lock()
+
+    def add(self, renderer, path, timings, signal=path_rendered):
+        timings = dict(timings)
+        minified = timings.pop("minified", None)
+        with self.lock:
+            entry = self.paths.setdefault(path, {"renderer": renderer})
+            if renderer is not None:
+                entry["renderer"] = renderer
+            for name, value in timings.items():
+                entry[name] = entry.get(name, 0) + value
+        if minified is not None:
+            self.add_minified(*minified)
+        _send(signal, renderer=renderer, path=path, timings=timings)
+
+    def add_body(self, digest, size=None):
+        """
+        Records a rendered body by its hash (and size, if known), for the
+        dedupe ratio: how many bodies were identical to one seen before.
+        """
+        with self.lock:
+            self.dedupe["bodies"] += 1
+            if digest in self.digests:
+                self.dedupe["duplicates"] += 1
+                self.dedupe["bytes_saved"] += size or 0
+            else:
+                self.digests.add(digest)
+
+    def add_minified(self, mimetype, size, minified_size, bodies=1):
+        """
+        Records that `bodies` bodies of `mimetype`, `size` bytes in all,
+        were minified to `minified_size` bytes.
+        """
+        with self.lock:
+            totals = self.minified.setdefault(
+                mimetype, {"bodies": 0, "bytes": 0, "bytes_saved": 0}
+            )
+            totals["bodies"] += bodies
+            totals["bytes"] += size
+            totals["bytes_saved"] += size - minified_size
+
+    def add_failure(self, renderer, path, error):
+        """ Records that `path` could not be rendered (or uploaded). """
+        with self.lock:
+            self.failures.append({
+                "renderer": renderer, "path": path, "error": error
+            })
+
+    @staticmethod
+    def _total(entry):
+        return sum(value for name, value in entry.items()
+                   if name not in ("renderer", "bytes"))
+
+    @classmethod
+    def _summarize(cls, entries):
+        summary = {"paths": len(entries)}
+        for entry in entries:
+            for name, value in entry.items():
+                if name != "renderer":
+                    summary[name] = summary.get(name, 0) + value
+        totals = sorted(cls._total(entry) for entry in entries)
+        if totals:
+            summary["p50"] = _percentile(totals, 0.5)
+            summary["p99"] = _percentile(totals, 0.99)
+        return summary
+
+    def as_dict(self):
+        finished = time.time()
+        with self.lock:
+            entries = list(self.paths.items())
+
+        renderers = {}
+        for path, entry in entries:
+            renderers.setdefault(entry["renderer"], []).append(entry)
+
+        slowest = heapq.nlargest(
+            getattr(settings, "MEDUSA_REPORT_SLOWEST", 20),
+            entries,
+            key=lambda item: self._total(item[1])
+        )
+        return {
+            "started": datetime.utcfromtimestamp(self.started).isoformat(),
+            "finished": datetime.utcfromtimestamp(finished).isoformat(),
+            "seconds": finished - self.started,
+            "totals": self._summarize([entry for path, entry in entries]),
+            "renderers": dict(
+                (name, self._summarize(renderer_entries))
+                for name, renderer_entries in renderers.items()
+            ),
+            "slowest": [
+                dict(entry, path=path, total=self._total(entry))
+                for path, entry in slowest
+            ],
+            "failures": self.failures,
+            "first_chunks": self.first_chunks,
+            "tuning": self.tuning,
+            "dedupe": dict(self.dedupe, ratio=(
+                float(self.dedupe["bodies"]) /
+                (self.dedupe["bodies"] - self.dedupe["duplicates"])
+                if self.dedupe["bodies"] else None
+            )),
+            "minified": self.minified,
+        }
+
+    def finish(self):
+        """
+        Prints a summary (and any failures), writes the JSON report to
+        MEDUSA_REPORT_PATH (if set) and sends `report_ready`.
+        """
+        data = self.as_dict()
+        print("Rendered %d paths in %.1f seconds." % (
+            data["totals"]["paths"], data["seconds"]
+        ))
+        if data["dedupe"]["duplicates"]:
+            print("%(duplicates)d of %(bodies)d bodies (%(bytes_saved)d "
+                  "bytes) were duplicates; dedupe ratio %(ratio).2f."
+                  % data["dedupe"])
+        for mimetype, totals in sorted(data["minified"].items()):
+            print("Minified %d %s bodies: %d of %d bytes (%.0f%%) saved." % (
+                totals["bodies"], mimetype, totals["bytes_saved"],
+                totals["bytes"],
+                100.0 * totals["bytes_saved"] / max(totals["bytes"], 1)
+            ))
+        if data["failures"]:
+            print("%d paths failed:" % len(data["failures"]))
+            for failure in data["failures"]:
+                print("  %s: %s" % (
+                    failure["path"], failure["error"].strip().split("\n")[-1]
+                ))
+        report_path = getattr(settings, "MEDUSA_REPORT_PATH", None)
+        if report_path:
+            with open(report_path, "w") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            print("Wrote timing report to %s." % report_path)
+        with self.lock:
+            _save_costs(self.paths)
+        _send(report_ready, report=data)
+        return data
+
+
+# The report of the current run.
+report = Report()
@@ -0,0 +1,485 @@
+"""
+Feeds the paths of any number of renderers through one shared worker pool.
+
+The `staticsitegen` command creates a single pool up front and hands every
+renderer from `get_static_renderers()` to `render_all`, so worker startup is
+paid once and the paths of all renderers share one global queue instead of
+each renderer waiting for the previous one to finish.
+
+A path that fails is retried (if the failure looks transient) and otherwise
+recorded in the report, so one broken page does not abort the whole run.
+"""
+from __future__ import print_function
+import socket
+import time
+import traceback
+try:
+    import queue
+except ImportError:  # <Python 3.
+    import Queue as queue
+from django.conf import settings
+from .client import get_client
+from .journal import journal
+from .prefetch import cache as prefetch_cache
+from .report import collect as collect_timings, load_costs, record, report
+from .tuner import Tuner, get_cpu_time, get_peak_rss
+
+__all__ = ('call_with_retries', 'create_pool', 'load_paths', 'render_all',
+           'warm_up')
+
+# Whether this (worker) process has yet to render its first chunk.
+_first_chunk = True
+
+
+def warm_up(templates=(), funcs=()):
+    """
+    Does the work a fresh worker would otherwise do during its first few
+    requests: loads (and, with the cached template loader, compiles)
+    `templates`, populates the URL resolver, connects to the databases and
+    calls each of `funcs`.
+    """
+    from django.db import connections
+    from django.template.loader import get_template
+    try:
+        from django.urls import get_resolver
+    except ImportError:  # <Django 1.10.
+        from django.core.urlresolvers import get_resolver
+
+    for name in templates:
+        get_template(name)
+    # Populates the resolver's (lazily built) lookup tables.
+    get_resolver().reverse_dict
+    for conn in connections.all():
+        # Projects without a database still have the dummy backend.
+        if not conn.settings_dict.get("ENGINE", "").endswith(".dummy"):
+            conn.ensure_connection()
+    for func in funcs:
+        func()
+
+
+def _init_worker(templates, funcs):
+    # Only needed when workers are spawned rather than forked; a forked
+    # worker inherits the already configured Django from its parent.
+    import django
+    if hasattr(django, "setup"):
+        from django.apps import apps
+        if not apps.ready:
+            django.setup()
+
+    # Pay for middleware loading etc. once, before the first path arrives.
+    get_client()
+    if getattr(settings, "MEDUSA_WARM_UP", True):
+        try:
+            warm_up(templates, funcs)
+        except Exception:
+            # Raising here would make the pool restart the worker forever.
+            print("Warming up a worker failed:\n%s" % traceback.format_exc())
+
+
+def _is_transient(error):
+    """
+    Whether `error` may go away by trying again: I/O and network errors, a
+    dropped database connection, and 5xx errors from S3, as opposed to bugs
+    in a view and the responses it returns.
+    """
+    from django.db import InterfaceError, OperationalError
+    if isinstance(error, (IOError, OSError, socket.error, InterfaceError,
+                          OperationalError)):
+        return True
+    try:
+        from boto.exception import BotoServerError
+    except ImportError:
+        return False
+    return isinstance(error, BotoServerError) and error.status >= 500
+
+
+def call_with_retries(func, *args):
+    """
+    Returns `func(*args)`. Transient errors (see `_is_transient`) are retried
+    MEDUSA_RETRIES times (default: 2), waiting MEDUSA_RETRY_DELAY seconds
+    (default: 1) before the first retry and twice as long before each next
+    one; the last of them, or any other error, is raised.
+
+    Database connections that broke are closed before each retry, so that
+    the next attempt opens a new one.
+    """
+    from django.db import close_old_connections
+
+    retries = getattr(settings, "MEDUSA_RETRIES", 2)
+    delay = getattr(settings, "MEDUSA_RETRY_DELAY", 1.0)
+    attempt = 0
+    while True:
+        try:
+            return func(*args)
+        except Exception as e:
+            if not _is_transient(e) or attempt >= retries:
+                raise
+        close_old_connections()
+        time.sleep(delay * 2 ** attempt)
+        attempt += 1
+
+
+def _render_one(render_func, args):
+    """
+    Returns `(render_func(args), None)`, or `(None, traceback)` if it fails
+    (after retrying, see `call_with_retries`).
+    """
+    try:
+        return call_with_retries(render_func, args), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def _prefetch(prefetch_func, paths):
+    prefetch_cache.clear()
+    start = time.time()
+    try:
+        prefetch_func(paths)
+    except Exception:
+        # The views are expected to cope without prefetched objects.
+        prefetch_cache.clear()
+        print("Prefetching failed, rendering without it:\n%s"
+              % traceback.format_exc())
+    elapsed = time.time() - start
+    for path in paths:
+        record(path, prefetch=elapsed / len(paths))
+
+
+def _render_chunk(task):
+    global _first_chunk
+    index, render_func, prefetch_func, chunk = task
+    start, start_cpu = time.time(), get_cpu_time()
+    try:
+        if prefetch_func is not None:
+            _prefetch(prefetch_func, [path for path, args in chunk])
+        results = [
+            (path, ) + _render_one(render_func, args) for path, args in chunk
+        ]
+    except Exception:
+        collect_timings()
+        return index, None, None, traceback.format_exc(), None
+
+    # For the tuner, and to report how long each worker took for its first
+    # chunk, which is where any lazy setup left over after warming up shows.
+    stats = {
+        "paths": len(chunk),
+        "wall": time.time() - start,
+        "cpu": get_cpu_time() - start_cpu,
+        "rss": get_peak_rss(),
+        "first": _first_chunk,
+    }
+    _first_chunk = False
+    return index, results, collect_timings(), None, stats
+
+
+def _get_name(renderer):
+    return "%s.%s" % (type(renderer).__module__, type(renderer).__name__)
+
+
+def _add_timings(renderer, timings):
+    name = _get_name(renderer)
+    for path, path_timings in timings:
+        report.add(name, path, path_timings)
+
+
+def _collect(renderer, path, result, error):
+    if error is None:
+        renderer.collect_result(result)
+        renderer.journal_result(path, result)
+    else:
+        report.add_failure(_get_name(renderer), path, error)
+        renderer.collect_failure(path, error)
+
+
+def create_pool(renderer_cls, renderers=None):
+    """
+    Returns a `multiprocessing.Pool` sized for the given renderer class (or
+    MEDUSA_PROCESSES, if set) whose workers are ready to render.
+
+    Unless MEDUSA_WARM_UP is False, each worker is warmed up (see `warm_up`)
+    with the `warmup_templates` and `warmup_func` of `renderers` (default:
+    just `renderer_cls`) as it starts.
+    """
+    from multiprocessing import Pool, cpu_count
+    from django.db import connections
+
+    processes = getattr(settings, "MEDUSA_PROCESSES", None)
+    if not processes:
+        processes = renderer_cls.processes or cpu_count()
+        if getattr(settings, "MEDUSA_ADAPTIVE", True):
+            # Room for the tuner to keep more workers busy when pages
+            # mostly wait on I/O. Every worker holds database connections,
+            # so this is opt-in.
+            processes = max(processes, getattr(
+                settings, "MEDUSA_MAX_PROCESSES", processes
+            ))
+
+    # Forked workers must not share the parent's database connections.
+    for conn in connections.all():
+        conn.close()
+
+    templates, funcs = [], []
+    for renderer in renderers or [renderer_cls]:
+        templates += [name for name in renderer.warmup_templates
+                      if name not in templates]
+        if renderer.warmup_func is not None\
+        and renderer.warmup_func not in funcs:
+            funcs.append(renderer.warmup_func)
+
+    print("Generating with up to %d processes..." % processes)
+    return Pool(processes, initializer=_init_worker,
+                initargs=(templates, funcs))
+
+
+def _load_paths(renderer):
+    from django.db import connections
+    try:
+        renderer.paths
+    finally:
+        # Connections are per thread; don't leave this one's open.
+        for conn in connections.all():
+            conn.close()
+
+
+def load_paths(renderers):
+    """
+    Evaluates (and memoizes) `get_paths` of every renderer that doesn't
+    stream its paths, concurrently in up to MEDUSA_PATH_THREADS threads
+    (default: 8), so that startup doesn't take as long as all of them
+    one after the other.
+    """
+    renderers = [
+        renderer for renderer in renderers if not renderer.is_streaming()
+    ]
+    threads = min(getattr(settings, "MEDUSA_PATH_THREADS", 8), len(renderers))
+    if threads <= 1:
+        for renderer in renderers:
+            renderer.paths
+        return
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(threads)
+    try:
+        pool.map(_load_paths, renderers, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _iter_pending(renderer):
+    # Results journaled by a previous attempt of this run are handed back
+    # as they are instead of rendering those paths again.
+    for path in renderer.iter_paths():
+        completed, result = journal.get(path)
+        if completed:
+            renderer.collect_journaled(result)
+        else:
+            yield path
+
+
+def _spread(known, unknown):
+    """
+    Returns the entries of `known` with those of `unknown` spread evenly
+    among them, each after its share of `known` ones.
+    """
+    merged = []
+    taken = 0
+    for number, entry in enumerate(unknown, 1):
+        stop = -(-number * len(known) // len(unknown))
+        merged.extend(known[taken:stop])
+        merged.append(entry)
+        taken = stop
+    merged.extend(known[taken:])
+    return merged
+
+
+def _schedule(renderers):
+    """
+    Returns `(priority, cost, index, path)` for every path of the renderers
+    that don't stream their paths, highest `get_priority` first and then
+    longest first by the cost recorded in MEDUSA_COST_HISTORY, so that no
+    expensive page is left running on its own at the end of the run. Paths
+    without a recorded cost (counted as the median one) are spread evenly
+    among the others, in their original order.
+    """
+    costs = load_costs()
+    median = 0
+    if costs:
+        median = sorted(costs.values())[len(costs) // 2]
+
+    # Priority -> ([known entries], [unknown entries]).
+    groups = {}
+    for index, renderer in enumerate(renderers):
+        if renderer.is_streaming():
+            continue
+        for path in _iter_pending(renderer):
+            priority = renderer.get_priority(path)
+            known, unknown = groups.setdefault(priority, ([], []))
+            if path in costs:
+                known.append((priority, costs[path], index, path))
+            else:
+                unknown.append((priority, median, index, path))
+
+    entries = []
+    for priority in sorted(groups, reverse=True):
+        known, unknown = groups[priority]
+        # Stable, so that paths with the same cost keep their order.
+        known.sort(key=lambda entry: -entry[1])
+        entries += _spread(known, unknown)
+    return entries
+
+
+def _iter_path_chunks(renderers, tuner):
+    """
+    Yields `(index, paths)` for chunks of paths of `renderers[index]`, in
+    the order of `_schedule`, followed by those of streaming renderers.
+    """
+    # A chunk is handed out once it has as many paths as the tuner says or
+    # (by their recorded cost) should take MEDUSA_CHUNK_SECONDS, or when
+    # the next path has a lower priority. The chunk size is looked up for
+    # every path, as the tuner changes it.
+    chunks = {}
+    last_priority = None
+    for priority, cost, index, path in _schedule(renderers):
+        if priority != last_priority:
+            for pending in sorted(chunks):
+                yield pending, chunks.pop(pending)[0]
+            last_priority = priority
+        chunk = chunks.setdefault(index, [[], 0])
+        chunk[0].append(path)
+        chunk[1] += cost
+        if len(chunk[0]) >= tuner.get_chunksize(renderers[index])\
+        or chunk[1] >= tuner.chunk_seconds:
+            yield index, chunks.pop(index)[0]
+    for pending in sorted(chunks):
+        yield pending, chunks.pop(pending)[0]
+
+    for index, renderer in enumerate(renderers):
+        if not renderer.is_streaming():
+            continue
+        chunk = []
+        for path in _iter_pending(renderer):
+            chunk.append(path)
+            if len(chunk) >= tuner.get_chunksize(renderer):
+                yield index, chunk
+                chunk = []
+        if chunk:
+            yield index, chunk
+
+
+def _iter_chunks(renderers, tuner):
+    for index, paths in _iter_path_chunks(renderers, tuner):
+        renderer = renderers[index]
+        yield index, renderer.render_func, renderer.prefetch_func, [
+            (path, renderer.get_render_args(path)) for path in paths
+        ]
+
+
+def _get_worker_pids(pool):
+    # The pool replaces workers that die, under new process IDs.
+    return set(worker.pid for worker in pool._pool)
+
+
+def render_all(renderers, pool=None):
+    """
+    Renders every path of the given renderer instances and hands each result
+    back to the renderer that produced it via `collect_result`.
+
+    Without a pool, paths are rendered serially in this process. With one,
+    the number of busy workers and the chunk size are tuned as the run goes
+    on (see `Tuner`).
+    """
+    from multiprocessing import cpu_count
+
+    load_paths(renderers)
+    for renderer in renderers:
+        renderer.setup()
+
+    tuner = Tuner(pool._processes if pool is not None else 1, cpu_count())
+    if pool is None:
+        for renderer in renderers:
+            renderer.client = get_client()
+        for index, paths in _iter_path_chunks(renderers, tuner):
+            renderer = renderers[index]
+            if renderer.prefetch_func is not None:
+                _prefetch(renderer.prefetch_func, paths)
+            for path in paths:
+                result, error = _render_one(renderer.render_path, path)
+                _collect(renderer, path, result, error)
+            _add_timings(renderer, collect_timings())
+    else:
+        # Keep a bounded number of chunks in flight, so that workers always
+        # have something queued while this process keeps producing chunks
+        # (and running the next renderer's `get_paths`), without ever pulling
+        # more paths out of a streaming `get_paths` than that.
+        results = queue.Queue()
+        in_flight = peak_in_flight = 0
+        pending = []
+        workers = _get_worker_pids(pool)
+
+        def wait():
+            """
+            Returns the next chunk's results. Raises instead of waiting
+            forever if a chunk failed outside of `_render_chunk` (e.g. its
+            results couldn't be pickled), which calls no callback, or if a
+            worker died (e.g. killed for running out of memory), which loses
+            the chunk it was rendering.
+            """
+            while True:
+                try:
+                    return results.get(timeout=1)
+                except queue.Empty:
+                    pass
+                for async_result in pending:
+                    if async_result.ready()\
+                    and not async_result.successful():
+                        async_result.get()
+                if _get_worker_pids(pool) != workers:
+                    raise Exception(
+                        "A worker process died while rendering; the paths "
+                        "it was given are lost."
+                    )
+
+        def consume():
+            index, chunk_results, timings, error, stats = wait()
+            pending[:] = [
+                r for r in pending if not (r.ready() and r.successful())
+            ]
+            if error is not None:
+                raise Exception("Rendering failed in a worker:\n%s" % error)
+            if stats["first"]:
+                report.first_chunks.append(stats["wall"] / stats["paths"])
+            tuner.update(stats["paths"], stats["wall"], stats["cpu"],
+                         stats["rss"])
+            for path, result, error in chunk_results:
+                _collect(renderers[index], path, result, error)
+            _add_timings(renderers[index], timings)
+
+        submitted = total_depth = 0
+        for task in _iter_chunks(renderers, tuner):
+            pending.append(pool.apply_async(_render_chunk, (task, ),
+                                            callback=results.put))
+            in_flight += 1
+            submitted += 1
+            total_depth += in_flight
+            peak_in_flight = max(peak_in_flight, in_flight)
+            while in_flight >= tuner.max_in_flight:
+                consume()
+                in_flight -= 1
+        while in_flight:
+            consume()
+            in_flight -= 1
+
+        print("Render stage: %d processes, chunks in flight peak %d, "
+              "average %.1f; %.1f ms per path in each worker's first chunk." % (
+                  pool._processes,
+                  peak_in_flight,
+                  float(total_depth) / max(submitted, 1),
+                  1000 * sum(report.first_chunks)
+                  / max(len(report.first_chunks), 1)
+              ))
+        tuner.log()
+        report.tuning = tuner.as_dict()
+
+    for renderer in renderers:
+        renderer.teardown()
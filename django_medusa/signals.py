@@ -0,0 +1,17 @@
+"""
+Signals sent in the main process during a `staticsitegen` run, e.g. to
+forward timings to a metrics system. Errors raised by receivers are printed
+and otherwise ignored, so that they can't break a run.
+"""
+from django.dispatch import Signal
+
+# Sent each time timings are recorded for a path, with `renderer` (the
+# dotted name of the renderer class, or None for later stages such as the S3
+# upload), `path` and `timings` (a dict of seconds per stage, plus `bytes`).
+# A path may be reported more than once, e.g. once rendered and once
+# uploaded.
+path_rendered = Signal()
+
+# Sent by `finalize_output` with `report`, the dict written to
+# MEDUSA_REPORT_PATH.
+report_ready = Signal()
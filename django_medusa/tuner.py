@@ -0,0 +1,196 @@
+"""
+Tunes how many pool workers render at once and how many paths they are
+handed at a time, from what the workers measure as the run goes on.
+
+Workers report the wall clock and CPU time of every chunk. Pages that keep
+the CPU busy need one worker per CPU; the longer they wait on I/O (the
+database, the network) instead, the more workers it takes to keep the CPUs
+busy. Workers are only added while the busy ones, together with this
+process (which feeds them and collects their results), leave CPU time
+unused, and (where /proc/stat tells) the machine as a whole isn't busy
+either, e.g. with workers still warming up. Once the CPUs are
+oversubscribed, each worker's share of the CPU drops, which would otherwise
+look like more waiting.
+
+Chunks are sized to take about MEDUSA_CHUNK_SECONDS each, so that cheap
+pages don't drown in per-chunk overhead and expensive ones don't pile up
+behind each other.
+"""
+from __future__ import division, print_function
+import math
+import os
+import sys
+import time
+from django.conf import settings
+try:
+    import resource
+except ImportError:  # Windows.
+    resource = None
+
+__all__ = ('Tuner', 'get_cpu_time', 'get_peak_rss', 'get_system_cpu_times')
+
+
+def get_cpu_time():
+    """ CPU time (user and system) used by this process so far, in seconds. """
+    times = os.times()
+    return times[0] + times[1]
+
+
+def get_system_cpu_times():
+    """
+    Busy and total CPU time of the whole machine so far, in clock ticks, or
+    None where /proc/stat isn't available.
+    """
+    try:
+        with open("/proc/stat", "r") as f:
+            fields = [int(value) for value in f.readline().split()[1:8]]
+    except (IOError, OSError, ValueError):
+        return None
+    if len(fields) < 4:
+        return None
+    # Idle, and waiting on I/O.
+    idle = sum(fields[3:5])
+    return sum(fields) - idle, sum(fields)
+
+
+def get_peak_rss():
+    """ Peak resident memory of this process in MB, or None if unknown. """
+    if resource is None:
+        return None
+    divisor = 1024.0 * (1024 if sys.platform == "darwin" else 1)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+
+
+class Tuner(object):
+    """
+    Holds the current number of workers to keep busy (out of a pool of
+    `processes`) and the current chunk size.
+
+    Settings:
+      * MEDUSA_ADAPTIVE (default: True) -- tune while rendering.
+      * MEDUSA_PROCESSES -- pin the number of workers (and the pool size).
+      * MEDUSA_MAX_PROCESSES -- pool size to tune within (default: the
+        renderer's `processes`, or one per CPU).
+      * MEDUSA_CHUNKSIZE -- pin the chunk size (default before tuning: 5).
+        A renderer's own `chunksize` always wins.
+      * MEDUSA_CHUNK_SECONDS (default: 0.5) -- how long a chunk should take.
+      * MEDUSA_MEMORY_LIMIT -- in MB; never keep more workers busy than fit
+        next to this process, going by the largest worker seen so far.
+    """
+    # Weight of the latest chunk in the moving averages.
+    smoothing = 0.2
+
+    # Share of the CPUs the busy workers must leave unused for more workers
+    # to be added.
+    cpu_headroom = 0.1
+
+    max_chunksize = 500
+
+    def __init__(self, processes, cpus):
+        self.processes = processes
+        self.cpus = cpus
+        adaptive = getattr(settings, "MEDUSA_ADAPTIVE", True)
+        pinned_chunksize = getattr(settings, "MEDUSA_CHUNKSIZE", None)
+        self.tune_workers = adaptive\
+            and not getattr(settings, "MEDUSA_PROCESSES", None)
+        self.tune_chunksize = adaptive and not pinned_chunksize
+        self.chunk_seconds = getattr(settings, "MEDUSA_CHUNK_SECONDS", 0.5)
+        self.memory_limit = getattr(settings, "MEDUSA_MEMORY_LIMIT", None)
+
+        self.workers = min(cpus, processes) if self.tune_workers\
+            else processes
+        self.chunksize = pinned_chunksize or 5
+        self.path_seconds = None
+        self.cpu_fraction = None
+        # CPUs' worth of time used by this process.
+        self.main_cpus = None
+        self.last_times = time.time(), get_cpu_time()
+        # Share of the machine's CPU time that was in use, if known.
+        self.system_busy = None
+        self.last_system = get_system_cpu_times()
+        self.worker_rss = 0
+
+    def get_chunksize(self, renderer):
+        return renderer.chunksize or self.chunksize
+
+    @property
+    def max_in_flight(self):
+        # With every worker busy, keep a chunk queued for each of them so
+        # that none has to wait for this process. Otherwise queued chunks
+        # would just go to the workers being held back.
+        if self.workers >= self.processes:
+            return self.processes * 2
+        return self.workers
+
+    def _average(self, average, value):
+        if average is None:
+            return value
+        return average + self.smoothing * (value - average)
+
+    def update(self, paths, wall, cpu, rss):
+        """ Takes the measurements of one chunk into account. """
+        if not paths or wall <= 0:
+            return
+        self.path_seconds = self._average(self.path_seconds, wall / paths)
+        self.cpu_fraction = self._average(
+            self.cpu_fraction, min(max(cpu / wall, 0.05), 1.0)
+        )
+        self.worker_rss = max(self.worker_rss, rss or 0)
+        now = time.time(), get_cpu_time()
+        if now[0] > self.last_times[0]:
+            self.main_cpus = self._average(
+                self.main_cpus,
+                (now[1] - self.last_times[1]) / (now[0] - self.last_times[0])
+            )
+        self.last_times = now
+        system = get_system_cpu_times()
+        if system and self.last_system and system[1] > self.last_system[1]:
+            self.system_busy = self._average(
+                self.system_busy,
+                (system[0] - self.last_system[0])
+                / (system[1] - self.last_system[1])
+            )
+        self.last_system = system
+
+        if self.tune_chunksize:
+            self.chunksize = int(min(
+                max(round(self.chunk_seconds / self.path_seconds), 1),
+                self.max_chunksize
+            ))
+
+        workers = self.workers
+        busy_cpus = self.workers * self.cpu_fraction + (self.main_cpus or 0)
+        if self.tune_workers\
+        and busy_cpus < self.cpus * (1 - self.cpu_headroom)\
+        and (self.system_busy or 0) < 1 - self.cpu_headroom:
+            # Enough workers to keep the CPUs busy, at most twice as many as
+            # now: the next chunks tell whether they still are.
+            workers = min(int(math.ceil(self.cpus / self.cpu_fraction)),
+                          self.workers * 2)
+        if self.memory_limit and self.worker_rss:
+            available = self.memory_limit - (get_peak_rss() or 0)
+            workers = min(workers, int(available // self.worker_rss))
+        self.workers = min(max(workers, 1), self.processes)
+
+    def as_dict(self):
+        return {
+            "processes": self.processes,
+            "workers": self.workers,
+            "chunksize": self.chunksize,
+            "path_seconds": self.path_seconds,
+            "cpu_fraction": self.cpu_fraction,
+            "main_cpus": self.main_cpus,
+            "system_busy": self.system_busy,
+            "worker_rss_mb": self.worker_rss,
+        }
+
+    def log(self):
+        if self.path_seconds is None:
+            return
+        print("Settled on %d of %d processes and chunks of %d paths "
+              "(%.1f ms per path, %.0f%% of it on the CPU). To keep these, "
+              "set MEDUSA_PROCESSES = %d and MEDUSA_CHUNKSIZE = %d." % (
+                  self.workers, self.processes, self.chunksize,
+                  self.path_seconds * 1000, self.cpu_fraction * 100,
+                  self.workers, self.chunksize
+              ))
@@ -1,14 +1,39 @@
 from __future__ import print_function
-import imp
 from django.conf import settings
+from django.utils.module_loading import module_has_submodule
 from importlib import import_module
-import sys
+import json
+import os
 
+# Renderer classes found so far in this process.
+_registry = None
 
-def get_static_renderers():
-    module_name = 'renderers'
-    renderers = []
 
+def _get_apps():
+    """ Returns the (name, module) of each installed app. """
+    try:
+        from django.apps import apps
+    except ImportError:  # <Django 1.7.
+        apps = None
+    if apps is not None and apps.ready:
+        return [(config.name, config.module)
+                for config in apps.get_app_configs()]
+
+    modules = []
+    for app in settings.INSTALLED_APPS:
+        try:
+            modules.append((app, import_module(app)))
+        except ImportError:
+            print("Skipping app '%s'... (Not found)" % app)
+    return modules
+
+
+def _find_renderer_modules():
+    """
+    Returns the names of the `renderers` modules of the project and of each
+    installed app (except this one).
+    """
+    module_name = 'renderers'
     modules_to_check = []
 
     # Hackish: do this in case we have some project top-level
@@ -19,38 +44,105 @@ def get_static_renderers():
             # strip off '.settings" from end of module
             # (want project module, if possible)
             settings_module = settings_module.split(".", 1)[0]
-        modules_to_check += [settings_module, ]
+        try:
+            modules_to_check.append(
+                (settings_module, import_module(settings_module))
+            )
+        except ImportError:
+            pass
 
     # INSTALLED_APPS that aren't the project itself (also ignoring this
     # django_medusa module)
-    modules_to_check += filter(
-        lambda x: (x != "django_medusa") and (x != settings_module),
-        settings.INSTALLED_APPS
-    )
+    modules_to_check += [
+        (app, module) for app, module in _get_apps()
+        if app != "django_medusa" and app != settings_module
+    ]
 
-    for app in modules_to_check:
-        try:
-            import_module(app)
-            app_path = sys.modules[app].__path__
-        except AttributeError:
-            print("Skipping app '%s'... (Not found)" % app)
-            continue
-        try:
-            imp.find_module(module_name, app_path)
-        except ImportError:
+    found = []
+    for app, module in modules_to_check:
+        if not hasattr(module, "__path__"):
+            print("Skipping app '%s'... (Not a package)" % app)
+        elif not module_has_submodule(module, module_name):
             print("Skipping app '%s'... (No 'renderers.py')" % app)
-            continue
-        try:
-            app_render_module = import_module('%s.%s' % (app, module_name))
-            if hasattr(app_render_module, "renderers"):
-                renderers += getattr(app_render_module, module_name)
-            else:
-                print("Skipping app '%s'... ('%s.renderers' does not contain "\
-                      "'renderers' var (list of render classes)" % (app, app))
-        except AttributeError:
-            print("Skipping app '%s'... (Error importing '%s.renderers')" % (
-                app, app
-            ))
+        else:
+            found.append("%s.%s" % (app, module_name))
+    return found
+
+
+def _get_cached_renderer_modules():
+    """
+    Like `_find_renderer_modules`, but remembers the result in
+    MEDUSA_RENDERER_CACHE (a JSON file) until INSTALLED_APPS changes.
+    """
+    cache_path = getattr(settings, "MEDUSA_RENDERER_CACHE", None)
+    if not cache_path:
+        return _find_renderer_modules()
+
+    installed_apps = list(settings.INSTALLED_APPS)
+    try:
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        if cached["installed_apps"] == installed_apps:
+            return cached["modules"]
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    modules = _find_renderer_modules()
+    temp_path = cache_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"installed_apps": installed_apps, "modules": modules}, f)
+    os.rename(temp_path, cache_path)
+    return modules
+
+
+def _import_renderers(dotted_path):
+    """
+    Returns the renderer classes named by `dotted_path`: either a renderer
+    class, or a module with a `renderers` list.
+    """
+    if "." not in dotted_path:
+        return list(import_module(dotted_path).renderers)
+
+    # Look the name up rather than catching ImportError, so that an error
+    # raised inside the module (e.g. a missing dependency) isn't mistaken
+    # for the module not existing.
+    module_path, name = dotted_path.rsplit(".", 1)
+    module = import_module(module_path)
+    if module_has_submodule(module, name):
+        return list(import_module(dotted_path).renderers)
+    # Not a module, so it should be a class in one.
+    return [getattr(module, name)]
+
+
+def get_static_renderers():
+    """
+    Returns the renderer classes to run: those listed (as dotted paths to
+    classes or `renderers` modules) in MEDUSA_RENDERERS if set, otherwise the
+    `renderers` lists of the `renderers.py` modules of the project and of
+    every installed app.
+    """
+    global _registry
+    if _registry is not None:
+        return _registry
+
+    explicit = getattr(settings, "MEDUSA_RENDERERS", None)
+    if explicit is not None:
+        renderers = []
+        for dotted_path in explicit:
+            renderers += _import_renderers(dotted_path)
+        _registry = tuple(renderers)
+        return _registry
+
+    renderers = []
+    for module_path in _get_cached_renderer_modules():
+        app = module_path.rsplit(".", 1)[0]
+        app_render_module = import_module(module_path)
+        if hasattr(app_render_module, "renderers"):
+            renderers += app_render_module.renderers
+        else:
+            print("Skipping app '%s'... ('%s.renderers' does not contain "\
+                  "'renderers' var (list of render classes)" % (app, app))
             continue
         print ("Found renderers for '%s'..." % app)
-    return tuple(renderers)
+    _registry = tuple(renderers)
+    return _registry
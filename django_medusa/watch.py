@@ -0,0 +1,118 @@
+"""
+The queue of paths for `staticsitewatch` to render again.
+
+Events are files in MEDUSA_WATCH_QUEUE (default: ./medusa-queue), each
+holding one JSON object per line: `{"path": ..., "renderer": ...}`, where
+`renderer` is the dotted name of the renderer class the path belongs to (or
+None if unknown). `push` can be called from any process that shares the
+directory, e.g. a web server's, and `staticsitewatch --push` does the same
+from the command line.
+
+To push the paths of model instances as they are saved or deleted, call
+`connect_signals()` from your project (e.g. in an `AppConfig.ready`): each
+renderer whose `watch_models` the instance is one of is asked for the paths
+to render again via `get_changed_paths`.
+"""
+import itertools
+import json
+import os
+import time
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+try:
+    from django.db.transaction import on_commit
+except ImportError:  # <Django 1.9.
+    def on_commit(func):
+        func()
+
+__all__ = ('connect_signals', 'get_queue_dir', 'get_renderer_name', 'pop',
+           'push')
+
+# Keeps the names of events pushed within the same microsecond apart.
+_counter = itertools.count()
+
+
+def get_queue_dir():
+    return getattr(settings, "MEDUSA_WATCH_QUEUE", "medusa-queue")
+
+
+def get_renderer_name(renderer):
+    """ Returns the dotted name of a renderer class, as queued. """
+    if renderer is None:
+        return None
+    return "%s.%s" % (renderer.__module__, renderer.__name__)
+
+
+def push(paths, renderer=None):
+    """
+    Queues `paths` of the renderer class `renderer` (if known) to be
+    rendered again.
+    """
+    paths = list(paths)
+    if not paths:
+        return
+    queue_dir = get_queue_dir()
+    if not os.path.exists(queue_dir):
+        try:
+            os.makedirs(queue_dir)
+        except OSError:
+            # Created by another process in the meantime.
+            pass
+    name = "%.6f-%d-%d" % (time.time(), os.getpid(), next(_counter))
+    temp_path = os.path.join(queue_dir, "." + name)
+    with open(temp_path, "w") as f:
+        for path in paths:
+            f.write(json.dumps({
+                "path": path, "renderer": get_renderer_name(renderer)
+            }) + "\n")
+    # Only complete events show up under their final name.
+    os.rename(temp_path, os.path.join(queue_dir, name))
+
+
+def pop():
+    """
+    Takes every event from the queue and returns their `(renderer, path)`
+    pairs, oldest first and without duplicates.
+    """
+    queue_dir = get_queue_dir()
+    if not os.path.exists(queue_dir):
+        return []
+    # Names start with the time, so this is the order they were pushed in.
+    names = sorted(name for name in os.listdir(queue_dir)
+                   if not name.startswith("."))
+    events, seen = [], set()
+    for name in names:
+        event_path = os.path.join(queue_dir, name)
+        with open(event_path, "r") as f:
+            lines = f.readlines()
+        os.remove(event_path)
+        for line in lines:
+            entry = json.loads(line)
+            event = (entry["renderer"], entry["path"])
+            if event not in seen:
+                seen.add(event)
+                events.append(event)
+    return events
+
+
+def _push_changed_paths(sender, instance, **kwargs):
+    from .utils import get_static_renderers
+    for renderer in get_static_renderers():
+        if renderer.watch_models\
+        and isinstance(instance, tuple(renderer.watch_models)):
+            paths = renderer().get_changed_paths(instance)
+            # Not before the change is visible to other processes.
+            on_commit(lambda paths=paths, renderer=renderer:
+                      push(paths, renderer))
+
+
+def connect_signals():
+    """
+    Pushes the paths that renderers map a model instance to (see
+    `watch_models` and `get_changed_paths`) whenever one is saved or
+    deleted.
+    """
+    post_save.connect(_push_changed_paths,
+                      dispatch_uid="django_medusa.watch")
+    post_delete.connect(_push_changed_paths,
+                        dispatch_uid="django_medusa.watch")